@@ -0,0 +1,219 @@
+"""
+Computer opponent: negamax search with alpha-beta pruning over the bitboard engine.
+
+The search runs iterative deepening until its time budget is spent, and remembers positions in a fixed size
+Zobrist-hashed transposition table which is kept for the life of the process, so later searches start warm. Like the
+engine, nothing here touches Django, so searches can run in a separate process.
+"""
+import random
+import time
+
+from .engine import Bitboard, CELLS, FULL_MASK, WIN_MASKS, WIN_MASKS_BY_CELL, legal_moves
+
+WIN_SCORE = 100000
+# Scores this close to WIN_SCORE are wins found by search, adjusted by how many moves away they are.
+WIN_THRESHOLD = WIN_SCORE - CELLS
+# Evaluation score for a line with this many of one player's stones and none of the other's.
+LINE_SCORES = (0, 1, 8, 64)
+
+# Random keys for each space, for each side. Seeded so every process hashes positions the same way.
+_random = random.Random(4)
+ZOBRIST = tuple(tuple(_random.getrandbits(64) for index in range(CELLS)) for side in range(2))
+
+# Spaces on more lines are worth trying first.
+MOVE_PRIORITY = tuple(len(masks) for masks in WIN_MASKS_BY_CELL)
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+
+class SearchTimeout(Exception):
+    """The time budget ran out part way through a search."""
+
+
+class TranspositionTable:
+    """
+    A fixed number of slots of search results, indexed by Zobrist hash.
+
+    A slot is replaced if it's empty, was stored by an earlier search, or the new result was searched at least as
+    deep. So deep results from the current search survive shallow ones, and the table never grows.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.slots = [None] * size
+        self.generation = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def probe(self, key):
+        """Return (key, depth, flag, score, move, generation) for the position, or None."""
+        slot = self.slots[key % self.size]
+        if slot is not None and slot[0] == key:
+            return slot
+        return None
+
+    def store(self, key, depth, flag, score, move):
+        index = key % self.size
+        slot = self.slots[index]
+        if slot is None or slot[5] != self.generation or depth >= slot[1]:
+            self.slots[index] = (key, depth, flag, score, move, self.generation)
+
+
+def evaluate(mine, theirs):
+    """Score the position for the player owning mine, from the lines each player could still complete."""
+    score = 0
+    for mask in WIN_MASKS:
+        my_stones = mine & mask
+        their_stones = theirs & mask
+        if my_stones and not their_stones:
+            score += LINE_SCORES[my_stones.bit_count()]
+        elif their_stones and not my_stones:
+            score -= LINE_SCORES[their_stones.bit_count()]
+    return score
+
+
+class Searcher:
+    def __init__(self, table):
+        self.table = table
+        self.deadline = None
+        self.nodes = 0
+        self.root_move = None
+
+    def search(self, mine, theirs, time_budget, max_depth):
+        """
+        Return the bit index of the best move for the player owning mine, who is next to move.
+
+        Each depth is searched in turn until max_depth or the time budget runs out, and the best move from the
+        deepest completed search is returned.
+        """
+        self.deadline = time.monotonic() + time_budget
+        self.nodes = 0
+        self.table.new_search()
+        side = (mine | theirs).bit_count() % 2
+        key = 0
+        for index in range(CELLS):
+            if mine >> index & 1:
+                key ^= ZOBRIST[side][index]
+            elif theirs >> index & 1:
+                key ^= ZOBRIST[1 - side][index]
+
+        best_move = self._ordered_moves(mine | theirs, None)[0]
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self._negamax(mine, theirs, key, side, depth, -WIN_SCORE, WIN_SCORE, 0)
+            except SearchTimeout:
+                break
+            best_move = self.root_move
+            if abs(score) >= WIN_THRESHOLD:
+                # The result is decided, searching deeper won't change it.
+                break
+        return best_move
+
+    def _ordered_moves(self, occupied, first_move):
+        moves = legal_moves(occupied)
+        moves.sort(key=MOVE_PRIORITY.__getitem__, reverse=True)
+        if first_move is not None and first_move in moves:
+            moves.remove(first_move)
+            moves.insert(0, first_move)
+        return moves
+
+    def _negamax(self, mine, theirs, key, side, depth, alpha, beta, ply):
+        """Return the score of the position for the player owning mine, who is next to move."""
+        self.nodes += 1
+        if not self.nodes & 255 and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+        occupied = mine | theirs
+        if occupied == FULL_MASK:
+            return 0
+
+        original_alpha = alpha
+        table_move = None
+        entry = self.table.probe(key)
+        if entry is not None:
+            _, entry_depth, flag, score, table_move, _ = entry
+            if entry_depth >= depth and ply > 0:
+                score = _score_from_table(score, ply)
+                if flag == EXACT:
+                    return score
+                elif flag == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        moves = self._ordered_moves(occupied, table_move)
+        for index in moves:
+            stones = mine | 1 << index
+            for mask in WIN_MASKS_BY_CELL[index]:
+                if stones & mask == mask:
+                    self.table.store(key, depth, EXACT, _score_to_table(WIN_SCORE - ply, ply), index)
+                    if ply == 0:
+                        self.root_move = index
+                    return WIN_SCORE - ply
+
+        if depth == 0:
+            return evaluate(mine, theirs)
+
+        best_score = -WIN_SCORE
+        best_move = moves[0]
+        for index in moves:
+            score = -self._negamax(
+                theirs, mine | 1 << index, key ^ ZOBRIST[side][index], 1 - side, depth - 1, -beta, -alpha, ply + 1
+            )
+            if score > best_score:
+                best_score = score
+                best_move = index
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.table.store(key, depth, flag, _score_to_table(best_score, ply), best_move)
+        if ply == 0:
+            self.root_move = best_move
+        return best_score
+
+
+def _score_to_table(score, ply):
+    """Store wins as moves from the stored position rather than from the root, so they can be reused anywhere."""
+    if score >= WIN_THRESHOLD:
+        return score + ply
+    if score <= -WIN_THRESHOLD:
+        return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    if score >= WIN_THRESHOLD:
+        return score - ply
+    if score <= -WIN_THRESHOLD:
+        return score + ply
+    return score
+
+
+_tables = {}  # Table size to the table, kept between searches.
+
+
+def choose_move(board_snapshot, player, time_budget, max_depth, table_size):
+    """
+    Return the bit index of the move the computer should make as player, who must be next to move.
+
+    Arguments are plain values so this can be submitted to a process pool.
+    """
+    bitboard = Bitboard.from_snapshot(board_snapshot)
+    mine = bitboard.stones.get(player, 0)
+    theirs = bitboard.occupied & ~mine
+    if table_size not in _tables:
+        _tables[table_size] = TranspositionTable(table_size)
+    return Searcher(_tables[table_size]).search(mine, theirs, time_budget, max_depth)
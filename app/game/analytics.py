@@ -0,0 +1,109 @@
+"""
+Statistics over historical games, computed with NumPy from a packed games file (see packing and export_games).
+
+The file is memory-mapped, and games are processed a chunk at a time as whole arrays, so memory stays bounded and
+nothing loops over individual games in Python.
+"""
+import numpy as np
+
+from . import packing
+from .engine import CELLS, HEIGHT, WIDTH, WIN_MASKS
+from .models import Game
+
+# Matches packing.RECORD.
+RECORD_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('state', 'u1'),
+    ('winner', 'u1'),
+    ('computer_player', 'u1'),
+    ('move_count', 'u1'),
+    ('moves', 'u1', (CELLS,)),
+    ('padding', 'V3'),
+])
+assert RECORD_DTYPE.itemsize == packing.RECORD.size
+
+COMPLETED = packing.STATES.index(Game.STATE_COMPLETED)
+
+WIN_MASKS_ARRAY = np.array(WIN_MASKS, dtype=np.uint64)
+CELL_BITS = np.uint64(1) << np.arange(CELLS, dtype=np.uint64)
+
+
+def load_games(path):
+    """Return the games in a packed games file as a read-only memory-mapped array of RECORD_DTYPE."""
+    with open(path, 'rb') as f:
+        packing.read_header(f)
+        f.seek(0, 2)
+        size = f.tell() - packing.HEADER.size
+    if size % RECORD_DTYPE.itemsize:
+        raise packing.PackingError("The file ends part way through a game.")
+    if not size:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=packing.HEADER.size)
+
+
+def stone_masks(games):
+    """Return each player's stones at the end of each game, as two arrays of bitboards like engine.Bitboard's."""
+    made = np.arange(CELLS) < games['move_count'][:, None]
+    bits = np.where(made, CELL_BITS[np.where(made, games['moves'], 0)], np.uint64(0))
+    # Players take turns starting with player 1, so even plies are player 1's.
+    return np.bitwise_or.reduce(bits[:, 0::2], axis=1), np.bitwise_or.reduce(bits[:, 1::2], axis=1)
+
+
+def winning_line_cells(games):
+    """Return a bitboard for each game with the cells in the winner's completed lines set."""
+    player_1, player_2 = stone_masks(games)
+    winner = games['winner']
+    stones = np.where(winner == 1, player_1, np.where(winner == 2, player_2, np.uint64(0)))
+    cells = np.zeros(len(games), dtype=np.uint64)
+    # A loop over the lines rather than the games, each step working on every game at once.
+    for mask in WIN_MASKS_ARRAY:
+        cells |= np.where((stones & mask) == mask, mask, np.uint64(0))
+    return cells
+
+
+def analyze(games, chunk_size=100_000):
+    """Return statistics for the completed games, as a JSON serializable dict."""
+    length_counts = np.zeros(CELLS + 1, dtype=np.int64)
+    winner_counts = np.zeros(len(packing.PLAYERS), dtype=np.int64)
+    opening_games = np.zeros(CELLS, dtype=np.int64)
+    opening_wins = np.zeros(CELLS, dtype=np.int64)
+    winning_cell_counts = np.zeros(CELLS, dtype=np.int64)
+
+    for start in range(0, len(games), chunk_size):
+        chunk = games[start:start + chunk_size]
+        chunk = chunk[chunk['state'] == COMPLETED]
+        if not len(chunk):
+            continue
+
+        length_counts += np.bincount(chunk['move_count'], minlength=CELLS + 1)
+        winner_counts += np.bincount(chunk['winner'], minlength=len(packing.PLAYERS))
+
+        opened = chunk[chunk['move_count'] > 0]
+        openings = opened['moves'][:, 0]
+        opening_games += np.bincount(openings, minlength=CELLS)
+        opening_wins += np.bincount(openings, weights=opened['winner'] == 1, minlength=CELLS).astype(np.int64)
+
+        cells = winning_line_cells(chunk)
+        winning_cell_counts += [np.count_nonzero(cells & bit) for bit in CELL_BITS]
+
+    completed = int(length_counts.sum())
+    with np.errstate(invalid='ignore', divide='ignore'):
+        opening_win_rate = np.where(opening_games > 0, opening_wins / opening_games, np.nan)
+
+    return {
+        'games': len(games),
+        'completed': completed,
+        'first_player_win_rate': float(winner_counts[1] / completed) if completed else None,
+        'second_player_win_rate': float(winner_counts[2] / completed) if completed else None,
+        'draw_rate': float(winner_counts[0] / completed) if completed else None,
+        # Grids are rows of spaces, y then x, like the board.
+        'opening_games': _grid(opening_games),
+        'opening_first_player_win_rate': _grid(opening_win_rate),
+        'winning_line_heatmap': _grid(winning_cell_counts),
+        'length_distribution': {length: int(count) for length, count in enumerate(length_counts) if count},
+    }
+
+
+def _grid(values):
+    """Return values for each cell as rows of plain Python numbers, with None for NaN."""
+    return [[None if np.isnan(value) else value.item() for value in row] for row in values.reshape(HEIGHT, WIDTH)]
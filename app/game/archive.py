@@ -0,0 +1,48 @@
+"""
+Archive completed games, replacing their GameMoves with one compact GameArchive row each.
+
+GameMove gets up to a row per space for every game, forever, but only games in progress need them as rows. Completed
+games are shown from board_snapshot, and their moves can still be had from Game.get_moves().
+"""
+import time
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Game, GameArchive, GameMove
+
+BATCH_SIZE = 500
+
+
+def archive_games(batch_size=BATCH_SIZE, pause=0):
+    """
+    Archive every completed game which hasn't been already, a batch at a time. Yield the number archived in each batch.
+
+    Each batch is its own short transaction, so only that batch's moves are locked, and only briefly. pause is seconds
+    to wait between batches, leaving the database room for live games.
+    """
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            games = list(
+                Game.objects.filter(state=Game.STATE_COMPLETED, archive__isnull=True, id__gt=last_id)
+                .order_by('id').only('id', 'width', 'height', 'win_length')[:batch_size]
+            )
+            if not games:
+                return
+            game_ids = [game.id for game in games]
+
+            moves = defaultdict(list)
+            rows = GameMove.objects.filter(game_id__in=game_ids).order_by('id')
+            for game_id, player, x, y in rows.values_list('game_id', 'player', 'x_coord', 'y_coord'):
+                moves[game_id].append((player, x, y))
+            GameArchive.objects.bulk_create([
+                GameArchive(game_id=game.id, moves=GameArchive.encode_moves(moves[game.id], game.get_geometry()))
+                for game in games
+            ])
+            GameMove.objects.filter(game_id__in=game_ids).delete()
+
+        last_id = game_ids[-1]
+        yield len(game_ids)
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,180 @@
+"""
+Benchmarks for the rules engine, the views and the notification path. Run them with the benchmark management command.
+
+Each benchmark returns plain dicts of timings, so a run can be written out as JSON and compared with an earlier one.
+"""
+import asyncio
+import json
+import random
+import statistics
+import timeit
+from time import perf_counter
+
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Game, PLAYER_1, PLAYER_2
+from .notifications import notify_game_event
+from .tokens import make_game_token
+
+
+def summarize(timings):
+    """Summarize a list of timings in seconds, in microseconds."""
+    timings = sorted(timings)
+    return {
+        'calls': len(timings),
+        'min_us': timings[0] * 1e6,
+        'median_us': statistics.median(timings) * 1e6,
+        'mean_us': statistics.fmean(timings) * 1e6,
+        'p95_us': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1e6,
+    }
+
+
+def measure(func, repeat=5):
+    """Time func with timeit, returning a summary of the time per call for each repeat."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return summarize([total / number for total in timer.repeat(repeat=repeat, number=number)])
+
+
+def random_playout(rng):
+    """Play a random game on an unsaved Game without the ORM. Return the game and the time each move took."""
+    game = Game(state=Game.STATE_IN_PROGRESS)
+    timings = []
+    while not game.is_complete():
+        x, y = rng.choice(game.legal_moves())
+        start = perf_counter()
+        game._apply_move(game.next_player, x, y)
+        timings.append(perf_counter() - start)
+    return game, timings
+
+
+def benchmark_model(games=200, seed=0):
+    """Benchmark the rules on unsaved games, so no database is involved."""
+    rng = random.Random(seed)
+    move_timings = []
+    playout_timings = []
+    for _ in range(games):
+        start = perf_counter()
+        game, timings = random_playout(rng)
+        playout_timings.append(perf_counter() - start)
+        move_timings.extend(timings)
+
+    # A board part way through a game, for checks which depend on how full the board is.
+    game = Game(state=Game.STATE_IN_PROGRESS)
+    for _ in range(20):
+        x, y = rng.choice(game.legal_moves())
+        game._apply_move(game.next_player, x, y)
+    x, y = game.legal_moves()[0]
+
+    return {
+        'move': summarize(move_timings),
+        'is_winning_move': measure(lambda: game._is_winning_move(game.next_player, x, y)),
+        'all_spaces_chosen': measure(game._all_spaces_chosen),
+        'legal_moves': measure(game.legal_moves),
+        'playout': summarize(playout_timings),
+    }
+
+
+def _timed_request(client, method, url, data=None):
+    """Make a request, returning (response, seconds, queries)."""
+    with CaptureQueriesContext(connection) as queries:
+        start = perf_counter()
+        response = getattr(client, method)(url, data)
+        elapsed = perf_counter() - start
+    return response, elapsed, len(queries)
+
+
+def _summarize_requests(timings, query_counts):
+    summary = summarize(timings)
+    summary['queries_min'] = min(query_counts)
+    summary['queries_max'] = max(query_counts)
+    return summary
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+def benchmark_views(games=20, board_requests=200, seed=0):
+    """
+    Benchmark index, move and board through the test client, counting queries.
+
+    This makes games in whatever database is configured, so call it with a test database in place.
+    """
+    rng = random.Random(seed)
+    results = {name: ([], []) for name in ('index_create', 'index_join', 'index_existing', 'move', 'board')}
+
+    def record(name, method, url, data=None):
+        response, elapsed, queries = _timed_request(clients[player], method, url, data)
+        results[name][0].append(elapsed)
+        results[name][1].append(queries)
+        return response
+
+    for _ in range(games):
+        clients = {PLAYER_1: Client(), PLAYER_2: Client()}
+        player = PLAYER_1
+        record('index_create', 'get', reverse('game:index'))
+        player = PLAYER_2
+        record('index_join', 'get', reverse('game:index'))
+        record('index_existing', 'get', reverse('game:index'))
+
+        game = Game.objects.get(id=clients[PLAYER_1].session['game_id'])
+        while not game.is_complete():
+            player = game.next_player
+            x, y = rng.choice(game.legal_moves())
+            record('move', 'post', reverse('game:move'), {'x': x, 'y': y})
+            game = Game.objects.get(id=game.id)
+
+    for _ in range(board_requests):
+        record('board', 'get', reverse('game:board'))
+
+    return {name: _summarize_requests(*timings) for name, timings in results.items()}
+
+
+def benchmark_notify(websocket_url, notifications=100, timeout=5):
+    """
+    Benchmark the time from sending a game change notification to it arriving on a websocket.
+
+    The websocket server must be running and listening to the same notification backend as Django.
+    """
+    return asyncio.run(_benchmark_notify(websocket_url, notifications, timeout))
+
+
+async def _benchmark_notify(websocket_url, notifications, timeout):
+    # Imported here since only this benchmark needs it, and it comes with Sanic.
+    import websockets
+
+    # The game doesn't have to exist, the listener only matches on its ID.
+    game = Game(id=-1, state=Game.STATE_IN_PROGRESS)
+    token = make_game_token(game.id, 'benchmark')
+    loop = asyncio.get_running_loop()
+    timings = []
+    async with websockets.connect(f"{websocket_url}changes/?token={token}") as ws:
+        assert json.loads(await asyncio.wait_for(ws.recv(), timeout))['event'] == 'connected'
+        for ply in range(notifications):
+            game.move_count = ply
+            start = perf_counter()
+            # Notifications come from another session, otherwise the websocket would ignore them.
+            await loop.run_in_executor(None, notify_game_event, game, 'other', PLAYER_2, 0, 0)
+            while json.loads(await asyncio.wait_for(ws.recv(), timeout)).get('ply') != ply:
+                pass
+            timings.append(perf_counter() - start)
+    return {'notify_to_websocket': summarize(timings)}
+
+
+def compare(results, baseline, threshold):
+    """
+    Return (benchmark name, baseline summary, summary) for each benchmark whose median got slower than threshold
+    times the baseline's, or which made more queries.
+    """
+    regressions = []
+    for section, benchmarks in results.items():
+        for name, summary in benchmarks.items():
+            old = baseline.get(section, {}).get(name)
+            if not isinstance(summary, dict) or not old:
+                continue
+            slower = summary['median_us'] > old['median_us'] * threshold
+            more_queries = summary.get('queries_max', 0) > old.get('queries_max', summary.get('queries_max', 0))
+            if slower or more_queries:
+                regressions.append((f"{section}.{name}", old, summary))
+    return regressions
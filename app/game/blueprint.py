@@ -1,55 +1,72 @@
-import asyncio
 import json
 
-import aiohttp
-import aiopg
-import psycopg2
 from sanic import Blueprint
+from sanic.exceptions import WebsocketClosed
 from sanic.log import logger
+from sanic.response import text
+from websockets.exceptions import ConnectionClosed
+
+from . import metrics
+from .changes import parse_since, serve_changes
+from .listener import GameChangesListener
+from .notifications import load_backend
+from .tokens import GameTokenResolver
 
 game_blueprint = Blueprint("Game")
 
 
+@game_blueprint.before_server_start
+async def start_listener(app, loop):
+    """Start the worker's shared game changes listener."""
+    app.ctx.game_tokens = GameTokenResolver(app.config.SECRET_KEY)
+    backend = load_backend(
+        app.config.NOTIFICATION_BACKEND,
+        database_url=app.config.DATABASE_URL,
+        socket_path=app.config.NOTIFICATION_SOCKET,
+    )
+    app.ctx.game_changes = GameChangesListener(backend)
+    app.add_task(app.ctx.game_changes.run(), name="game_changes_listener")
+
+
+@game_blueprint.before_server_stop
+async def stop_listener(app, loop):
+    await app.cancel_task("game_changes_listener", raise_exception=False)
+
+
 @game_blueprint.websocket("/changes")
 async def changes(request, ws):
     """
-    When a notification about game updates is received from PostgreSQL, emit an event on the websocket.
+    When a notification about game updates is received, emit an event on the websocket.
     """
+    metrics.WEBSOCKETS_OPEN.inc()
+    try:
+        await _send_changes(request, ws)
+    finally:
+        metrics.WEBSOCKETS_OPEN.dec()
+
+
+async def _send_changes(request, ws):
     await ws.send(json.dumps({'event': 'connected'}))
-    session_id = request.cookies.get("sessionid")
-    if not session_id:
+
+    # The token from the page says which game this session is playing.
+    resolved = request.app.ctx.game_tokens.resolve(request.args.get("token", ""))
+    if resolved is None:
+        logger.warning("Rejected websocket with a missing or invalid game token")
+        await ws.send(json.dumps({'event': 'error'}))
         return
+    game_id, client_id = resolved
 
-    # Get the game ID associated with this session.
-    async with aiohttp.ClientSession(raise_for_status=True) as session:
+    async def receive():
         try:
-            async with session.get(
-                    f"{request.app.config.HTTP_URL}_game/",
-                    cookies={"sessionid": session_id}
-            ) as response:
-                result = await response.json()
-                game_id = result['id']
-        except aiohttp.ClientError as e:
-            logger.warn(f"Failed to get game ID: {e}")
-
-    async def handle_game_changes(conn):
-        async with conn.cursor() as cur:
-            await cur.execute("LISTEN game_changes")
-            while True:
-                try:
-                    notification = await conn.notifies.get()
-                    logger.debug(f'Got notification: {notification.payload}')
-                    changed_game_id, changed_session_id = notification.payload.split(':')
-                    changed_game_id = int(changed_game_id)
-                    if game_id == changed_game_id and session_id != changed_session_id:
-                        # This is the game we're interested in, and the change did not come from our session.
-                        await ws.send(json.dumps({'event': 'changed'}))
-                except psycopg2.Error as e:
-                    logger.warn(f'Failed to receive notification: {e}')
-                    return
-                except KeyboardInterrupt:
-                    return
-
-    async with aiopg.connect(request.app.config.DATABASE_URL) as listenConn:
-        listener = handle_game_changes(listenConn)
-        await asyncio.gather(listener)
+            return await ws.recv()
+        except (ConnectionClosed, WebsocketClosed):
+            return None
+
+    since = parse_since(request.args.get("since"))
+    await serve_changes(request.app.ctx.game_changes, game_id, client_id, ws.send, receive, since)
+
+
+@game_blueprint.get("/metrics")
+async def metrics_view(request):
+    """Return this worker's metrics for Prometheus to scrape."""
+    return text(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,84 @@
+"""
+Plays the computer's moves in single player games.
+
+Replies are made on a thread pool so the request for the human's move returns straight away, and the search itself
+runs on a process pool so it doesn't compete with the web workers for the GIL. The human finds out about the reply
+through the usual game change notification.
+"""
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import ai
+from .cache import remember_game
+from .engine import cell_coordinates
+from .models import Game, MoveConflict
+from .notifications import notify_game_event
+
+logger = logging.getLogger(__name__)
+
+_reply_executor = None
+_search_executor = None
+
+
+def schedule_reply(game):
+    """Have the computer reply in the background, once the human's move is committed."""
+    transaction.on_commit(lambda: _get_reply_executor().submit(play_reply, game.id))
+
+
+def play_reply(game_id):
+    """Make the computer's move in the game, if it's the computer's turn."""
+    try:
+        game = Game.objects.get(id=game_id)
+        if game.is_complete() or game.next_player != game.computer_player:
+            return
+        x, y = choose_move(game)
+        try:
+            game.move(game.computer_player, x, y)
+        except MoveConflict:
+            # Something else moved in the meantime, so this reply is out of date.
+            return
+        remember_game(game)
+        notify_game_event(game, None, game.computer_player, x, y)
+    except Exception:
+        logger.exception(f"Computer failed to reply in game {game_id}")
+    finally:
+        # This isn't a request, so nothing else will tidy up the thread's database connection.
+        close_old_connections()
+
+
+def choose_move(game):
+    """Return the (x, y) coordinates the computer should play next in the game."""
+    args = (
+        game.board_snapshot,
+        game.computer_player,
+        settings.AI_TIME_BUDGET,
+        settings.AI_MAX_DEPTH,
+        settings.AI_TRANSPOSITION_TABLE_SIZE,
+    )
+    if settings.AI_PROCESSES:
+        index = _get_search_executor().submit(ai.choose_move, *args).result()
+    else:
+        index = ai.choose_move(*args)
+    return cell_coordinates(index)
+
+
+def _get_reply_executor():
+    global _reply_executor
+    if _reply_executor is None:
+        _reply_executor = ThreadPoolExecutor(max_workers=settings.AI_THREADS, thread_name_prefix="bot")
+    return _reply_executor
+
+
+def _get_search_executor():
+    global _search_executor
+    if _search_executor is None:
+        # Spawn rather than fork, since the web server process has threads of its own.
+        _search_executor = ProcessPoolExecutor(
+            max_workers=settings.AI_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _search_executor
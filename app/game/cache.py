@@ -0,0 +1,177 @@
+"""
+A per-process cache of games, so views don't load the same game from the database for every request.
+
+Both players of a game, and the board fetches that follow each move, ask for the same game over and over. Games are
+kept with their decoded board, least recently used first, and handed out as fresh Game instances.
+
+A cached game is only used if it's known to be current. By default that means checking its version against the
+database, which is a single column primary key lookup instead of loading and decoding the whole game. With
+GAME_CACHE_LISTEN set, each process instead listens for game change notifications and drops games as they change, so
+most lookups don't touch the database at all. Notifications can arrive after the next request does, so callers which
+know a game has reached a version (clients hear it with each change) pass min_version and get at least that.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import Game
+from .notifications import get_backend, listen_forever
+
+FIELDS = (
+    'id', 'state', 'next_player', 'winner', 'computer_player', 'width', 'height', 'win_length', 'board_snapshot',
+    'move_count', 'version',
+)
+
+
+class GameCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        # Set while a listener is connected, so everything cached since is dropped when it changes.
+        self.listening = False
+        self._games = OrderedDict()  # Game ID to (field values, bitboard), least recently used first.
+        # Game ID to the latest version heard about in a notification. A game loaded just before a notification about
+        # it arrives is older than that, and mustn't be cached after the notification has been handled.
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, game_id, min_version=None):
+        """Return the game, from the cache if it's current. Raise Game.DoesNotExist if there's no such game."""
+        entry = self._lookup(game_id, min_version)
+        if entry is not None:
+            values, bitboard = entry
+            version = values[FIELDS.index('version')]
+            if self.listening or Game.objects.filter(id=game_id, version=version).exists():
+                return self._build(values, bitboard)
+
+        game = Game.objects.get(id=game_id)
+        self.remember(game)
+        return game
+
+    async def aget(self, game_id, min_version=None):
+        """Like get(), with the async ORM."""
+        entry = self._lookup(game_id, min_version)
+        if entry is not None:
+            values, bitboard = entry
+            version = values[FIELDS.index('version')]
+            if self.listening or await Game.objects.filter(id=game_id, version=version).aexists():
+                return self._build(values, bitboard)
+
+        game = await Game.objects.aget(id=game_id)
+        self.remember(game)
+        return game
+
+    def _lookup(self, game_id, min_version):
+        """Return the cache entry for the game if there is one at min_version or newer, or None."""
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is None:
+                return None
+            self._games.move_to_end(game_id)
+        if min_version is not None and entry[0][FIELDS.index('version')] < min_version:
+            return None
+        return entry
+
+    def remember(self, game):
+        """Cache the game, as it is now, unless a newer version has been heard of."""
+        if not self.max_size:
+            return
+        entry = (tuple(getattr(game, field) for field in FIELDS), game._get_bitboard().copy())
+        with self._lock:
+            if game.version < self._versions.get(game.id, 0):
+                return
+            self._games[game.id] = entry
+            self._games.move_to_end(game.id)
+            while len(self._games) > self.max_size:
+                self._games.popitem(last=False)
+
+    def forget(self, game_id, version=None):
+        """Drop the game if it's older than version, or whatever its version if none is given."""
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is not None and (version is None or entry[0][FIELDS.index('version')] < version):
+                del self._games[game_id]
+            if version is not None and version > self._versions.get(game_id, 0):
+                self._versions[game_id] = version
+                self._versions.move_to_end(game_id)
+                while len(self._versions) > self.max_size:
+                    self._versions.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+
+    @staticmethod
+    def _build(values, bitboard):
+        game = Game.from_db('default', FIELDS, values)
+        game._bitboard = bitboard.copy()
+        return game
+
+    def handle_event(self, event):
+        """Drop the game a change notification is about, unless it's already cached at that version."""
+        try:
+            self.forget(int(event['game_id']), event.get('version'))
+        except (KeyError, TypeError, ValueError):
+            # Without knowing which game changed, none can be trusted.
+            self.clear()
+
+    def on_connect(self):
+        # Anything could have changed while the listener wasn't connected.
+        self.clear()
+        self.listening = True
+
+    def on_disconnect(self, error):
+        self.listening = False
+
+    async def listen(self, backend):
+        """Drop games as change notifications arrive, until cancelled, reconnecting when the connection is lost."""
+        await listen_forever(
+            backend, self.handle_event, "game cache listener",
+            on_connect=self.on_connect, on_disconnect=self.on_disconnect,
+        )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process's game cache, starting its listener thread if GAME_CACHE_LISTEN is set."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache = GameCache(settings.GAME_CACHE_SIZE)
+                if settings.GAME_CACHE_LISTEN:
+                    backend = get_backend()
+                    thread = threading.Thread(
+                        target=lambda: asyncio.run(cache.listen(backend)), name="game_cache_listener", daemon=True)
+                    thread.start()
+                _cache = cache
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_cache(setting, **kwargs):
+    global _cache
+    if setting in ('GAME_CACHE_SIZE', 'GAME_CACHE_LISTEN'):
+        _cache = None
+
+
+def get_game(game_id, min_version=None):
+    """Return the game with the ID from the process's cache, see GameCache.get()."""
+    return get_cache().get(game_id, min_version)
+
+
+async def aget_game(game_id, min_version=None):
+    """Like get_game(), for async views."""
+    return await get_cache().aget(game_id, min_version)
+
+
+def remember_game(game):
+    """Cache a game which has just been saved, once the transaction commits."""
+    transaction.on_commit(lambda: get_cache().remember(game))
@@ -0,0 +1,149 @@
+"""
+The changes websocket protocol, shared by the Sanic server (blueprint.py) and Django's ASGI application (websocket.py).
+
+After a "connected" event, clients get a "changed" event for each change to their game made by another client. Each
+connection has an Outbox where a change waiting to be sent is replaced by the next, so a slow client falls behind by
+one coalesced event rather than a growing backlog, and sends that take longer than SEND_TIMEOUT close the connection.
+The server pings every HEARTBEAT_INTERVAL and clients answer with a pong; connections which haven't sent anything for
+IDLE_TIMEOUT are closed, so half-open connections don't hold on to their subscriptions.
+
+Clients pass since, the latest version of the game they heard of (the page's version on their first connection), and
+are sent just the events they missed, or a change without a move, to fetch the whole board, if those aren't all still
+kept. Pages fetch that with the ETag of the board they have, starting with the one they were rendered with, so it's
+304 Not Modified when nothing was missed.
+"""
+import asyncio
+import json
+import logging
+from collections import deque
+from time import monotonic, perf_counter
+
+from . import metrics
+from .listener import changed_fields
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 20  # Seconds between pings.
+IDLE_TIMEOUT = 60  # Seconds without hearing from a client before its connection is closed.
+SEND_TIMEOUT = 10  # Seconds a client has to take each message.
+
+# Fields dropped when changes are coalesced, so clients fetch the whole board instead of patching in one move.
+MOVE_FIELDS = ('x', 'y', 'player', 'ply')
+
+
+class Outbox:
+    """
+    The messages waiting to be sent on one websocket: the changes, and a ping.
+
+    Changes made by the connection's own client (see tokens.get_client_id()) are dropped, since that client has the
+    response to its move. A change arriving while another is waiting replaces it, keeping the older one's arrival time
+    for the lag metric, so only missed events being replayed to a reconnecting client ever make more than one change
+    wait.
+    """
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self._changes = deque()  # (received_at or None, message)
+        self._ping = False
+        self._ready = asyncio.Event()
+
+    def put_nowait(self, event):
+        """Add a game event from the listener, which treats this like a queue. See GameChangesListener.subscribe()."""
+        if event['client_id'] == self.client_id:
+            return
+        message = {'event': 'changed', **changed_fields(event)}
+        received_at = event['received_at']
+        if self._changes:
+            received_at = self._changes.pop()[0]
+            for field in MOVE_FIELDS:
+                message.pop(field, None)
+        self._changes.append((received_at, message))
+        self._ready.set()
+
+    def replay(self, events):
+        """Add missed events, to be sent in full."""
+        for event in events:
+            if event['client_id'] != self.client_id:
+                self._changes.append((None, {'event': 'changed', **changed_fields(event)}))
+        self._ready.set()
+
+    def refresh(self):
+        """Add a change without a move, so the client fetches the whole board."""
+        self._changes.append((None, {'event': 'changed'}))
+        self._ready.set()
+
+    def ping(self):
+        self._ping = True
+        self._ready.set()
+
+    async def get(self):
+        """Wait for the next message. Return (the time its event was received, or None, message)."""
+        while not self._changes and not self._ping:
+            self._ready.clear()
+            await self._ready.wait()
+        if self._changes:
+            return self._changes.popleft()
+        self._ping = False
+        return None, {'event': 'ping'}
+
+
+async def serve_changes(listener, game_id, client_id, send, receive, since=None):
+    """
+    Send the game's changes until the client disconnects, stops responding or is too slow to take them. Start with the
+    changes after version since, if given.
+
+    send(text) and receive() are the server's: receive() returns the next message, or None once the client has gone.
+    The caller closes the connection afterwards.
+    """
+    outbox = Outbox(client_id)
+    last_heard = monotonic()
+
+    async def send_messages():
+        while True:
+            received_at, message = await outbox.get()
+            if received_at is not None:
+                metrics.NOTIFICATION_LAG_SECONDS.observe(perf_counter() - received_at)
+            try:
+                await asyncio.wait_for(send(json.dumps(message)), SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.info(f"Closing websocket for game {game_id}, which took too long to send to")
+                return
+
+    async def receive_messages():
+        nonlocal last_heard
+        while await receive() is not None:
+            last_heard = monotonic()
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if monotonic() - last_heard > IDLE_TIMEOUT:
+                logger.info(f"Closing websocket for game {game_id}, which stopped responding")
+                return
+            outbox.ping()
+
+    listener.subscribe(game_id, outbox)
+    if since is not None:
+        # Straight after subscribing, so nothing arrives in between.
+        missed = listener.events_since(game_id, since)
+        if missed is None:
+            outbox.refresh()
+        else:
+            outbox.replay(missed)
+    tasks = [asyncio.create_task(coroutine) for coroutine in (send_messages(), receive_messages(), heartbeat())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        listener.unsubscribe(game_id, outbox)
+
+
+def parse_since(value):
+    """Return the since parameter from a client, or None if it's missing or invalid."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,247 @@
+"""
+Bitboard rules engine for Side-Stacker.
+
+Each player's stones are kept as an integer bitmask. The space (x, y) is bit ``y * width + x``, so bit 0 is the
+top-left corner and the last bit is the bottom-right corner, the same coordinate system as ``Game``.
+
+Win, draw and legality checks are mask operations against tables built once for each board size, see Geometry. Nothing
+here touches Django, so bots, simulators and benchmarks can use the engine without the ORM.
+"""
+
+from functools import lru_cache
+
+# The standard board. Games can be other sizes, see get_geometry(), but the module level tables are for this one.
+WIDTH = 7
+HEIGHT = 7
+WIN_LENGTH = 4
+
+# Snapshots are one character per space in bit order: EMPTY_SPACE or the player.
+EMPTY_SPACE = "."
+
+# Directions to look for a line in. The opposite directions are covered by starting from the other end of the line.
+DIRECTIONS = (
+    (1, 0),  # ↔
+    (0, 1),  # ↕
+    (1, 1),  # ⤡
+    (1, -1),  # ⤢
+)
+
+
+class Geometry:
+    """
+    A board's dimensions and win length, with the tables the engine needs for them. Get them from get_geometry().
+
+    Only lines through the last move can have been completed by it, so win_masks_by_cell has the lines through each
+    space: at most win_length in each direction, however big the board is.
+    """
+
+    def __init__(self, width, height, win_length):
+        self.width = width
+        self.height = height
+        self.win_length = win_length
+        self.cells = width * height
+        self.full_mask = (1 << self.cells) - 1
+        self.row_mask = (1 << width) - 1
+        self.empty_snapshot = EMPTY_SPACE * self.cells
+
+        lines_by_cell = [[] for index in range(self.cells)]
+        win_masks = []
+        for y in range(height):
+            for x in range(width):
+                for dx, dy in DIRECTIONS:
+                    end_x = x + dx * (win_length - 1)
+                    end_y = y + dy * (win_length - 1)
+                    if not (0 <= end_x < width and 0 <= end_y < height):
+                        continue
+                    cells = [self.cell_index(x + dx * step, y + dy * step) for step in range(win_length)]
+                    mask = sum(1 << index for index in cells)
+                    win_masks.append(mask)
+                    for index in cells:
+                        lines_by_cell[index].append(mask)
+        self.win_masks = tuple(win_masks)
+        self.win_masks_by_cell = tuple(tuple(masks) for masks in lines_by_cell)
+
+    def __repr__(self):
+        return f"Geometry({self.width}, {self.height}, {self.win_length})"
+
+    def cell_index(self, x, y):
+        """Return the bit index of the space (x, y)."""
+        return y * self.width + x
+
+    def cell_coordinates(self, index):
+        """Return the (x, y) coordinates of a bit index."""
+        return index % self.width, index // self.width
+
+
+@lru_cache(maxsize=None)
+def get_geometry(width, height, win_length):
+    """Return the Geometry for the dimensions, built the first time they're asked for."""
+    return Geometry(width, height, win_length)
+
+
+STANDARD = get_geometry(WIDTH, HEIGHT, WIN_LENGTH)
+CELLS = STANDARD.cells
+FULL_MASK = STANDARD.full_mask
+EMPTY_SNAPSHOT = STANDARD.empty_snapshot
+WIN_MASKS = STANDARD.win_masks
+WIN_MASKS_BY_CELL = STANDARD.win_masks_by_cell
+ROW_MASK = STANDARD.row_mask
+
+
+def cell_index(x, y):
+    """Return the bit index of the space (x, y) on the standard board."""
+    return y * WIDTH + x
+
+
+def cell_coordinates(index):
+    """Return the (x, y) coordinates of a bit index on the standard board."""
+    return index % WIDTH, index // WIDTH
+
+
+def legal_moves(occupied):
+    """Return the bit indexes of the spaces which can be played on the standard board, given the occupied spaces."""
+    moves = []
+    for y in range(HEIGHT):
+        shift = y * WIDTH
+        row = occupied >> shift & ROW_MASK
+        if row == ROW_MASK:
+            continue
+        left = (~row & (row + 1)).bit_length() - 1  # Lowest empty space.
+        right = (~row & ROW_MASK).bit_length() - 1  # Highest empty space.
+        moves.append(shift + left)
+        if right != left:
+            moves.append(shift + right)
+    return moves
+
+
+class Bitboard:
+    """
+    The stones on a board, one bitmask per player.
+
+    Players are whatever values the caller uses to identify them (Game uses PLAYER_1 and PLAYER_2). The engine only
+    knows about spaces; whose turn it is and whether the game is over is up to the caller.
+
+    Each row also keeps its frontiers: left[y] is the x of the first empty space from the left (the width once the row
+    is full) and right[y] the first empty space from the right (-1 once full). They're moved along as stones are
+    played, so the side stacking rule and legal moves don't need to look at the row. With the move count kept by the
+    caller, nothing scans the whole board per move.
+    """
+    __slots__ = ("geometry", "stones", "occupied", "left", "right")
+
+    def __init__(self, geometry=STANDARD):
+        self.geometry = geometry
+        self.stones = {}
+        self.occupied = 0
+        self.left = [0] * geometry.height
+        self.right = [geometry.width - 1] * geometry.height
+
+    @classmethod
+    def from_moves(cls, moves, geometry=STANDARD):
+        """Build a board from an iterable of (player, x, y) tuples."""
+        bitboard = cls(geometry)
+        for player, x, y in moves:
+            bitboard.play(player, x, y)
+        return bitboard
+
+    @classmethod
+    def from_snapshot(cls, snapshot, geometry=STANDARD):
+        """Build a board from a snapshot string made by to_snapshot()."""
+        bitboard = cls(geometry)
+        for index, space in enumerate(snapshot):
+            if space != EMPTY_SPACE:
+                bit = 1 << index
+                bitboard.stones[space] = bitboard.stones.get(space, 0) | bit
+                bitboard.occupied |= bit
+        width, row_mask = geometry.width, geometry.row_mask
+        for y in range(geometry.height):
+            row = bitboard.occupied >> (y * width) & row_mask
+            bitboard.left[y] = (~row & (row + 1)).bit_length() - 1
+            bitboard.right[y] = (~row & row_mask).bit_length() - 1
+        return bitboard
+
+    def copy(self):
+        bitboard = Bitboard(self.geometry)
+        bitboard.stones = dict(self.stones)
+        bitboard.occupied = self.occupied
+        bitboard.left = list(self.left)
+        bitboard.right = list(self.right)
+        return bitboard
+
+    def to_snapshot(self):
+        """Return the board as a string of a character per space, EMPTY_SPACE or the player, in bit order."""
+        spaces = [EMPTY_SPACE] * self.geometry.cells
+        for player, mask in self.stones.items():
+            while mask:
+                bit = mask & -mask
+                spaces[bit.bit_length() - 1] = player
+                mask ^= bit
+        return "".join(spaces)
+
+    def get(self, x, y):
+        """Return the player who chose this space, or None."""
+        bit = 1 << self.geometry.cell_index(x, y)
+        if not self.occupied & bit:
+            return None
+        for player, mask in self.stones.items():
+            if mask & bit:
+                return player
+
+    def is_continuous_from_side(self, x, y):
+        """Return if every space to the left or every space to the right of (x, y) has been chosen."""
+        return x <= self.left[y] or x >= self.right[y]
+
+    def is_legal(self, x, y):
+        """Return if the space is empty and available from the side."""
+        return x == self.left[y] or x == self.right[y]
+
+    def legal_moves(self):
+        """Return the (x, y) coordinates of every space which can be played."""
+        moves = []
+        width = self.geometry.width
+        for y in range(self.geometry.height):
+            left = self.left[y]
+            if left == width:
+                continue
+            moves.append((left, y))
+            right = self.right[y]
+            if right != left:
+                moves.append((right, y))
+        return moves
+
+    def play(self, player, x, y):
+        """Place the player's stone on (x, y). No validation is done here."""
+        width = self.geometry.width
+        shift = y * width
+        bit = 1 << (shift + x)
+        self.stones[player] = self.stones.get(player, 0) | bit
+        self.occupied |= bit
+
+        # Move the row's frontiers past the new stone, and past any stones it has joined up with.
+        row = self.occupied >> shift & self.geometry.row_mask
+        if x == self.left[y]:
+            left = x + 1
+            while left < width and row >> left & 1:
+                left += 1
+            self.left[y] = left
+        if x == self.right[y]:
+            right = x - 1
+            while right >= 0 and row >> right & 1:
+                right -= 1
+            self.right[y] = right
+
+    def is_winning_move(self, player, x, y):
+        """Return if the player's stone on (x, y) completes a line of the win length or more."""
+        stones = self.stones.get(player, 0)
+        geometry = self.geometry
+        for mask in geometry.win_masks_by_cell[geometry.cell_index(x, y)]:
+            if stones & mask == mask:
+                return True
+        return False
+
+    def is_full(self):
+        """Return if all the spaces have been chosen."""
+        return self.occupied == self.geometry.full_mask
+
+    def to_rows(self):
+        """Return the board as a list of rows (y axis) of spaces (x axis), each a player or None."""
+        return [[self.get(x, y) for x in range(self.geometry.width)] for y in range(self.geometry.height)]
@@ -15,8 +15,8 @@ class MoveForm(forms.Form):
         cleaned_data = super().clean(*args, **kwargs)
 
         try:
+            # The game is saved as part of the move.
             self.game.move(self.player, cleaned_data['x'], cleaned_data['y'])
-            self.game.save()
         except ValueError as e:
             # Re-raise as a ValidationError
             raise forms.ValidationError(str(e), code="invalid")
@@ -0,0 +1,110 @@
+"""
+Cached board fragments.
+
+The board only changes when a move is made or the game changes state, but every board request, page load and move
+used to render all its spaces through the template again. Rendered boards are kept in a per-process LRU cache, and
+optionally in one of Django's caches (BOARD_CACHE_ALIAS) so processes can share them.
+
+Boards are rendered with a placeholder for the CSRF token, which is swapped for the requester's token on the way out,
+so the same fragment serves everyone looking at that position.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.middleware.csrf import get_token
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+CSRF_PLACEHOLDER = "csrf-token-placeholder"
+CACHE_TIMEOUT = 60 * 60  # Seconds to keep boards in Django's cache. Finished games aren't looked at for long.
+
+
+class BoardFragmentCache:
+    """A thread safe LRU cache of rendered boards, in front of an optional Django cache."""
+
+    def __init__(self, max_size=1024, cache_alias=None):
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self._fragments = OrderedDict()  # Key to rendered board, least recently used first.
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+        if self.cache_alias:
+            fragment = caches[self.cache_alias].get(self._cache_key(key))
+            if fragment is not None:
+                self._remember(key, fragment)
+        return fragment
+
+    def set(self, key, fragment):
+        self._remember(key, fragment)
+        if self.cache_alias:
+            caches[self.cache_alias].set(self._cache_key(key), fragment, CACHE_TIMEOUT)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def _remember(self, key, fragment):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+
+    @staticmethod
+    def _cache_key(key):
+        return "game.board:" + ":".join(str(part) for part in key)
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = BoardFragmentCache(settings.BOARD_CACHE_SIZE, settings.BOARD_CACHE_ALIAS)
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_cache(setting, **kwargs):
+    global _cache
+    if setting in ('BOARD_CACHE_SIZE', 'BOARD_CACHE_ALIAS'):
+        _cache = None
+
+
+def board_key(game, player):
+    """
+    Return the cache key for the game's board as the player sees it.
+
+    The state is part of the key since joining a game changes which spaces are playable without making a move. Game IDs
+    and versions can be reused (import_games inserts its own IDs, and every game starts at version 0), so the key also
+    describes the whole position, with the board's size and a digest of its snapshot. Keys are short and have no
+    spaces, so they suit memcached whatever the size of the board.
+    """
+    digest = hashlib.blake2b(game.board_snapshot.encode(), digest_size=16).hexdigest()
+    return (game.id, game.width, game.height, game.move_count, game.state.replace(" ", "_"), player, digest)
+
+
+def render_board(request, game, player):
+    """Return the board for the player viewing the game, rendering it only if it isn't cached."""
+    key = board_key(game, player)
+    cache = get_cache()
+    fragment = cache.get(key)
+    if fragment is None:
+        context = {'game': game, 'player': player, 'csrf_token': CSRF_PLACEHOLDER}
+        fragment = get_template("game/board.html").render(context)
+        cache.set(key, str(fragment))
+    return mark_safe(fragment.replace(CSRF_PLACEHOLDER, get_token(request)))
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from time import perf_counter
+
+from . import metrics
+from .notifications import listen_forever
+
+logger = logging.getLogger(__name__)
+
+# Recent events are kept for reconnecting clients, up to this many per game, for this many of the latest games.
+RECENT_EVENTS = 32
+RECENT_GAMES = 10000
+
+# Fields of a game event that are passed on to clients. Events without a ply make clients fetch the whole board.
+CHANGED_FIELDS = ('x', 'y', 'player', 'next_player', 'state', 'winner', 'ply', 'version')
+
+
+def changed_fields(event):
+    return {field: event[field] for field in CHANGED_FIELDS if field in event}
+
+
+class GameChangesListener:
+    """
+    A single notification backend connection per worker, fanning events out to the websockets interested in each game.
+    Used by both the Sanic server (blueprint.py) and Django's ASGI application (websocket.py).
+
+    Websockets subscribe() to a game ID and get a queue which only receives that game's events, so a notification
+    wakes only the connections for its game instead of every connection in the worker.
+
+    The latest events for each game are kept, so clients reconnecting with the last version they heard of can be sent
+    just the events they missed, see events_since().
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._subscribers = {}  # Game ID to a set of queues.
+        self._recent = OrderedDict()  # Game ID to a deque of its latest events, least recently changed game first.
+
+    def subscribe(self, game_id, queue=None):
+        """
+        Return a queue which receives events for the game. Pass it to unsubscribe() when done.
+
+        Instead of a new asyncio.Queue, the queue can be anything with a put_nowait() method, such as changes.Outbox.
+        """
+        if queue is None:
+            queue = asyncio.Queue()
+        self._subscribers.setdefault(game_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, game_id, queue):
+        queues = self._subscribers.get(game_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[game_id]
+
+    def dispatch(self, event):
+        """
+        Queue an event for the game's subscribers.
+
+        The event is the dict published by notifications.notify_game_event(). It's stamped with received_at, the
+        perf_counter() time it arrived, so senders can measure how long it waited.
+        """
+        try:
+            event['game_id'] = int(event['game_id'])
+        except (ValueError, TypeError, KeyError):
+            logger.warning(f'Ignoring malformed notification: {event}')
+            return
+
+        event['received_at'] = perf_counter()
+        self._remember(event)
+        for queue in self._subscribers.get(event['game_id'], ()):
+            queue.put_nowait(event)
+
+    def _remember(self, event):
+        if event.get('version') is None:
+            return
+        recent = self._recent.get(event['game_id'])
+        if recent is None:
+            recent = self._recent[event['game_id']] = deque(maxlen=RECENT_EVENTS)
+            if len(self._recent) > RECENT_GAMES:
+                self._recent.popitem(last=False)
+        else:
+            self._recent.move_to_end(event['game_id'])
+        recent.append(event)
+
+    def events_since(self, game_id, version):
+        """
+        Return the game's events after version, oldest first, or None if they might not all have been kept.
+
+        Events are numbered by the game's version, which goes up by one with every change.
+        """
+        recent = self._recent.get(game_id)
+        if not recent:
+            return None
+        if recent[-1]['version'] <= version:
+            return []
+        if recent[0]['version'] > version + 1:
+            return None
+        return [event for event in recent if event['version'] > version]
+
+    def dispatch_all(self, event):
+        """Queue the event for every subscriber, whatever their game."""
+        for game_id, queues in self._subscribers.items():
+            for queue in queues:
+                queue.put_nowait({**event, 'game_id': game_id, 'received_at': perf_counter()})
+
+    async def run(self):
+        """Listen for notifications until cancelled, reconnecting with backoff when the connection is lost."""
+        connected_before = False
+
+        def on_connect():
+            nonlocal connected_before
+            if connected_before:
+                # Anything sent while we were disconnected is lost, so forget the recent events, which have gaps now,
+                # and have everyone refresh.
+                self._recent.clear()
+                self.dispatch_all({'client_id': None})
+            connected_before = True
+
+        def handle_event(event):
+            logger.debug(f'Got notification: {event}')
+            self.dispatch(event)
+
+        await listen_forever(
+            self.backend, handle_event, "notification listener",
+            on_connect=on_connect, on_disconnect=lambda error: metrics.LISTENER_RECONNECTS.inc(),
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from game.archive import BATCH_SIZE, archive_games
+
+
+class Command(BaseCommand):
+    help = "Archive completed games, replacing their moves with one compact row per game."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Games archived per transaction.")
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to wait between batches.")
+
+    def handle(self, *args, **options):
+        total = 0
+        for archived in archive_games(options['batch_size'], options['pause']):
+            total += archived
+            if options['verbosity'] > 1:
+                self.stderr.write(f"Archived {total} games")
+        self.stderr.write(f"Archived {total} games")
@@ -0,0 +1,95 @@
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from game import benchmarks
+
+SECTIONS = ('model', 'views', 'notify')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the rules engine, the views and the notification path, and write the results as JSON. "
+        "Views are benchmarked in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sections', nargs='+', choices=SECTIONS, default=['model', 'views'],
+                            help="Benchmarks to run. notify needs a running websocket server.")
+        parser.add_argument('--output', help="File to write results to, instead of stdout.")
+        parser.add_argument('--baseline', help="Results from an earlier run to compare with.")
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help="How many times slower than the baseline's median counts as a regression.")
+        parser.add_argument('--games', type=int, default=200, help="Random games for the model benchmarks.")
+        parser.add_argument('--view-games', type=int, default=20, help="Games to play through the views.")
+        parser.add_argument('--notifications', type=int, default=100)
+        parser.add_argument('--websocket-url', default=settings.WEBSOCKET_URL)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = {
+            'meta': {
+                'time': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+        }
+
+        # Notifications go through the configured backend, since that's what the websocket server listens to.
+        if 'notify' in options['sections']:
+            if not self.can_notify():
+                raise CommandError("The notify benchmark needs PostgreSQL, or another notification backend.")
+            self.stderr.write("Benchmarking notifications...")
+            results['notify'] = benchmarks.benchmark_notify(options['websocket_url'], options['notifications'])
+
+        if 'model' in options['sections']:
+            self.stderr.write("Benchmarking the model...")
+            results['model'] = benchmarks.benchmark_model(options['games'], options['seed'])
+
+        if 'views' in options['sections']:
+            self.stderr.write("Benchmarking the views...")
+            results['views'] = self.benchmark_views(options['view_games'], options['seed'])
+            results['meta']['notifications'] = settings.GAME_NOTIFICATION_BACKEND if self.can_notify() else None
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = benchmarks.compare(results, baseline, options['threshold'])
+            for name, old, new in regressions:
+                self.stderr.write(
+                    f"{name}: median {old['median_us']:.1f}us -> {new['median_us']:.1f}us, "
+                    f"queries {old.get('queries_max', '-')} -> {new.get('queries_max', '-')}"
+                )
+            if regressions:
+                sys.exit(1)
+
+    def benchmark_views(self, games, seed):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            if self.can_notify():
+                return benchmarks.benchmark_views(games, seed=seed)
+            # Other databases can't send notifications, so keep them in memory.
+            with override_settings(GAME_NOTIFICATION_BACKEND='game.notifications.InMemoryBackend'):
+                return benchmarks.benchmark_views(games, seed=seed)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def can_notify(self):
+        return settings.GAME_NOTIFICATION_BACKEND != 'game.notifications.PostgresBackend' or (
+            connection.vendor == 'postgresql'
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+
+from game import packing
+from game.engine import HEIGHT, WIDTH, WIN_LENGTH
+from game.models import Game, GameMove
+
+
+class Command(BaseCommand):
+    help = "Stream every game on the standard board and its moves out to a packed games file, see game.packing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Games fetched from the database at a time.")
+
+    def handle(self, *args, **options):
+        # Games are fetched a chunk at a time, with one query for each chunk's moves, so memory doesn't grow with the
+        # size of the table. Archived games have their moves joined in instead.
+        # Other board sizes don't fit the format.
+        games = Game.objects.filter(width=WIDTH, height=HEIGHT, win_length=WIN_LENGTH)
+        games = games.order_by('id').select_related('archive').prefetch_related(
+            Prefetch('gamemove_set', queryset=GameMove.objects.only('game_id', 'player', 'x_coord', 'y_coord')),
+        ).only('id', 'state', 'winner', 'computer_player', 'width', 'height', 'win_length', 'archive__moves')
+
+        count = 0
+        with open(options['path'], 'wb') as f:
+            packing.write_header(f)
+            for game in games.iterator(chunk_size=options['chunk_size']):
+                try:
+                    f.write(packing.pack_game(game, game.get_moves()))
+                except packing.PackingError as e:
+                    raise CommandError(e)
+                count += 1
+        self.stderr.write(f"Exported {count} games to {options['path']}")
@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import packing
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute win rates, opening and winning line statistics and game lengths over a packed games file written by "
+        "export_games. Needs NumPy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Packed games file to read.")
+        parser.add_argument('--output', help="File to write results to, instead of stdout.")
+        parser.add_argument('--chunk-size', type=int, default=100_000, help="Games processed at a time.")
+
+    def handle(self, *args, **options):
+        try:
+            from game import analytics
+        except ImportError:
+            raise CommandError("NumPy is needed for game statistics. Install it with: pip install numpy")
+
+        try:
+            games = analytics.load_games(options['path'])
+        except packing.PackingError as e:
+            raise CommandError(e)
+        output = json.dumps(analytics.analyze(games, options['chunk_size']), indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
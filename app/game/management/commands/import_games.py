@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+
+from game import packing
+from game.models import Game, GameMove
+
+
+class Command(BaseCommand):
+    help = "Load games from a packed games file written by export_games. Game IDs are kept, so they must be free."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read.")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Games inserted at a time.")
+
+    def handle(self, *args, **options):
+        count = 0
+        try:
+            with open(options['path'], 'rb') as f:
+                packing.read_header(f)
+                while data := f.read(packing.RECORD.size * options['batch_size']):
+                    if len(data) % packing.RECORD.size:
+                        raise packing.PackingError("The file ends part way through a game.")
+                    count += self.import_batch(packing.RECORD.iter_unpack(data))
+        except packing.PackingError as e:
+            raise CommandError(f"{e} {count} games were imported before it.")
+        except IntegrityError as e:
+            raise CommandError(
+                f"Games in the file are already in the database, or clash with them: {e} {count} games were imported "
+                f"before them."
+            )
+        finally:
+            # Games were inserted with their own IDs, so make sure new ones don't collide with them. Batches are
+            # committed as they go, so that's needed even if a later one failed.
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Game, GameMove]):
+                    cursor.execute(sql)
+        self.stderr.write(f"Imported {count} games from {options['path']}")
+
+    def import_batch(self, records):
+        games = []
+        moves = []
+        for record in records:
+            game, game_moves = packing.unpack_game(record)
+            games.append(game)
+            moves.extend(game_moves)
+        with transaction.atomic():
+            Game.objects.bulk_create(games)
+            GameMove.objects.bulk_create(moves)
+        return len(games)
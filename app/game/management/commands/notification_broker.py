@@ -0,0 +1,28 @@
+import asyncio
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.notifications import run_broker
+
+
+class Command(BaseCommand):
+    help = "Run the broker which passes game change notifications on, for game.notifications.UnixSocketBackend."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.GAME_NOTIFICATION_SOCKET, help="Unix socket to listen on.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        # Left behind if the broker didn't stop cleanly, and would stop it listening again.
+        if os.path.exists(path):
+            os.unlink(path)
+        self.stderr.write(f"Listening on {path}")
+        try:
+            asyncio.run(run_broker(path))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from game import packing
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate games between two policies without the database, and write them as a packed games file for "
+        "game_stats or import_games. Needs NumPy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Packed games file to write.")
+        parser.add_argument('--games', type=int, default=100_000)
+        parser.add_argument('--batch-size', type=int, default=10_000, help="Games played together.")
+        parser.add_argument('--processes', type=int, help="Processes to play on, one per CPU by default.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--policy', default='game.simulate.random_policy',
+                            help="Dotted path to the function choosing moves, see game.simulate.random_policy.")
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+            from game import analytics, simulate
+        except ImportError:
+            raise CommandError("NumPy is needed to simulate games. Install it with: pip install numpy")
+
+        start = time.perf_counter()
+        winners, move_counts, moves = simulate.simulate(
+            options['games'],
+            batch_size=options['batch_size'],
+            processes=options['processes'],
+            seed=options['seed'],
+            policy=import_string(options['policy']),
+        )
+        elapsed = time.perf_counter() - start
+
+        records = np.zeros(len(winners), dtype=analytics.RECORD_DTYPE)
+        records['id'] = np.arange(1, len(winners) + 1)
+        records['state'] = analytics.COMPLETED
+        records['winner'] = winners
+        records['move_count'] = move_counts
+        records['moves'] = moves
+        with open(options['path'], 'wb') as f:
+            packing.write_header(f)
+            records.tofile(f)
+        self.stderr.write(f"Simulated {len(winners)} games in {elapsed:.1f}s")
@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models import F
+
+from . import metrics
+from .engine import HEIGHT, WIDTH, WIN_LENGTH
+from .models import Game, PLAYER_1, PLAYER_2
+
+MAX_JOIN_ATTEMPTS = 3
+
+JOINED = metrics.MATCHMAKING.labels("joined")
+CREATED = metrics.MATCHMAKING.labels("created")
+LOST_RACE = metrics.MATCHMAKING.labels("lost_race")
+
+
+def join_or_create_game(width=WIDTH, height=HEIGHT, win_length=WIN_LENGTH):
+    """
+    Join the longest waiting game as player 2, or create a new game as player 1 if none can be joined. Only games with
+    the same dimensions and win length are joined. Raise ValidationError if a game can't have them.
+
+    Return (game, player, joined). Waiting games are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so a burst of
+    arrivals each claim a different game instead of piling onto the same one. The conditional update is still needed
+    for databases without row locks, such as SQLite; losing it means another client got there first, so try again
+    with the next waiting game, a bounded number of times.
+    """
+    Game.validate_dimensions(width, height, win_length)
+    waiting = Game.objects.filter(state=Game.STATE_MATCH_MAKING, width=width, height=height, win_length=win_length)
+    for attempt in range(MAX_JOIN_ATTEMPTS):
+        with transaction.atomic():
+            game = waiting.select_for_update(skip_locked=True).first()
+            if game is None:
+                break
+            games_updated = Game.objects.filter(id=game.id, version=game.version).update(
+                state=Game.STATE_IN_PROGRESS,
+                version=F("version") + 1,
+            )
+        if games_updated:
+            game.state = Game.STATE_IN_PROGRESS
+            game.version += 1
+            JOINED.inc()
+            return game, PLAYER_2, True
+        LOST_RACE.inc()
+
+    CREATED.inc()
+    return Game.objects.create(width=width, height=height, win_length=win_length), PLAYER_1, False
@@ -0,0 +1,150 @@
+"""
+Counters, gauges and histograms for the hot paths, served as Prometheus text on /metrics by Django and Sanic.
+
+Each process keeps its own metrics in memory, so scrape every process. Nothing here needs Django, and recording is
+just arithmetic on existing objects: metrics with labels are looked up once, at import time where possible, and
+histograms have fixed buckets.
+"""
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, for request and notification latencies.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds in seconds, for the rules engine.
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50)
+
+_registry = []
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), register=True):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._children = {}  # Label values to child metric.
+        if not labels:
+            self._reset()
+        if register:
+            _registry.append(self)
+
+    def labels(self, *values):
+        """Return the child metric for the label values. Keep it rather than calling this on every request."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help, register=False)
+
+    def _samples(self):
+        """Yield (name suffix, label values, value) for each sample."""
+        if self.label_names:
+            for values, child in sorted(self._children.items()):
+                for suffix, extra, value in child._samples():
+                    yield suffix, self._format_labels(values) + extra, value
+        else:
+            yield from self._own_samples()
+
+    def _format_labels(self, values):
+        return tuple(f'{name}="{value}"' for name, value in zip(self.label_names, values))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self._samples():
+            label_text = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}{suffix}{label_text} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _reset(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def _own_samples(self):
+        yield "_total", (), self.value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _reset(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def _own_samples(self):
+        yield "", (), self.value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, register=True):
+        self.buckets = buckets
+        super().__init__(name, help, labels, register)
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets, register=False)
+
+    def _reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)  # The last is for values above every bucket.
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _own_samples(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield "_bucket", (f'le="{bound}"',), total
+        total += self.counts[-1]
+        yield "_bucket", ('le="+Inf"',), total
+        yield "_sum", (), self.sum
+        yield "_count", (), total
+
+
+def render():
+    """Return every metric in this process as Prometheus text."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Django.
+VIEW_SECONDS = Histogram("sidestacker_view_seconds", "Time to handle a request, by view.", labels=("view",))
+VIEW_QUERIES = Histogram(
+    "sidestacker_view_queries", "Database queries made by a request, by view.", labels=("view",),
+    buckets=COUNT_BUCKETS)
+VIEW_QUERY_SECONDS = Histogram(
+    "sidestacker_view_query_seconds", "Time spent in database queries by a request, by view.", labels=("view",))
+MOVE_SECONDS = Histogram(
+    "sidestacker_game_move_seconds", "Time taken by the rules engine to check and apply a move, see Game._apply_move().",
+    buckets=FAST_BUCKETS)
+MATCHMAKING = Counter(
+    "sidestacker_matchmaking", "Matchmaking outcomes: joined a waiting game, created a game, or lost a race to join.",
+    labels=("outcome",))
+
+# Sanic.
+WEBSOCKETS_OPEN = Gauge("sidestacker_websockets_open", "Websockets open to this process.")
+NOTIFICATION_LAG_SECONDS = Histogram(
+    "sidestacker_notification_lag_seconds",
+    "Time from the listener receiving a game change to sending it on a websocket.")
+LISTENER_RECONNECTS = Counter(
+    "sidestacker_listener_reconnects", "Times the game changes listener lost its connection and reconnected.")
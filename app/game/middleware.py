@@ -0,0 +1,203 @@
+import logging
+import threading
+import traceback
+from collections import Counter
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Transaction statements, which don't count towards budgets and are expected to repeat.
+TRANSACTION_SQL = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK')
+
+
+async def _get_response_async(get_response, request, execute_wrapper):
+    """
+    Await the response with the execute wrapper on the connection its queries use. Connections are per thread, and
+    sync_to_async() runs a request's thread sensitive code, the async ORM included, in a thread of its own.
+    """
+    await sync_to_async(_add_execute_wrapper)(execute_wrapper)
+    try:
+        return await get_response(request)
+    finally:
+        await sync_to_async(_remove_execute_wrapper)(execute_wrapper)
+
+
+def _add_execute_wrapper(execute_wrapper):
+    connection.execute_wrappers.append(execute_wrapper)
+
+
+def _remove_execute_wrapper(execute_wrapper):
+    connection.execute_wrappers.remove(execute_wrapper)
+
+
+class QueryTimer:
+    """A database execute wrapper counting queries and the time spent in them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += perf_counter() - start
+
+
+class MetricsMiddleware:
+    """Record each request's time, queries and time spent in queries, by view. See game.metrics."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self._local = threading.local()  # Each thread's QueryTimer, reused for every request.
+        self._view_metrics = {}  # View name to its (seconds, queries, query seconds) histograms.
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timer = getattr(self._local, 'timer', None)
+        if timer is None:
+            timer = self._local.timer = QueryTimer()
+        timer.count = 0
+        timer.seconds = 0
+
+        start = perf_counter()
+        # Appended directly rather than with connection.execute_wrapper(), which makes a context manager each time.
+        connection.execute_wrappers.append(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            connection.execute_wrappers.remove(timer)
+        self._record(request, perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        # Requests share the event loop's thread, so each gets a timer of its own.
+        timer = QueryTimer()
+        start = perf_counter()
+        response = await _get_response_async(self.get_response, request, timer)
+        self._record(request, perf_counter() - start, timer)
+        return response
+
+    def _record(self, request, elapsed, timer):
+        match = request.resolver_match
+        seconds, queries, query_seconds = self._get_view_metrics(match.url_name if match else None)
+        seconds.observe(elapsed)
+        queries.observe(timer.count)
+        query_seconds.observe(timer.seconds)
+
+    def _get_view_metrics(self, view):
+        view_metrics = self._view_metrics.get(view)
+        if view_metrics is None:
+            label = view or "unknown"
+            view_metrics = self._view_metrics[view] = (
+                metrics.VIEW_SECONDS.labels(label),
+                metrics.VIEW_QUERIES.labels(label),
+                metrics.VIEW_QUERY_SECONDS.labels(label),
+            )
+        return view_metrics
+
+
+class QueryBudgetExceeded(Exception):
+    """A request made more queries than its view's budget allows."""
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper recording each query's SQL, parameters and where in the project it came from.
+
+    Transaction statements aren't recorded, so the same work counts the same inside an atomic block, where they're
+    savepoints, as outside one.
+    """
+
+    def __init__(self):
+        self.queries = []  # (sql, params, origin) tuples, in the order they were made.
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.startswith(TRANSACTION_SQL):
+            self.queries.append((sql, repr(params), self._origin()))
+        return execute(sql, params, many, context)
+
+    @staticmethod
+    def _origin():
+        """Return "file:line in function" for the innermost project frame making the query, skipping this module."""
+        base_dir = str(settings.BASE_DIR)
+        for frame in reversed(traceback.extract_stack()):
+            if frame.filename.startswith(base_dir) and frame.filename != __file__:
+                return f"{frame.filename[len(base_dir) + 1:]}:{frame.lineno} in {frame.name}"
+        return "unknown"
+
+
+class QueryBudgetMiddleware:
+    """
+    A development aid, keeping an eye on the number of queries each request makes, not counting transaction
+    statements.
+
+    Queries made more than once with the same parameters, and the same SQL made repeatedly with different parameters
+    (often a loop which should be one query), are logged with where they came from. Requests making more queries than
+    their view's budget in QUERY_BUDGETS are logged too, or fail with QueryBudgetExceeded if QUERY_BUDGET_ENFORCE is
+    set. Views without a budget are only checked for repeats.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self._check(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        response = await _get_response_async(self.get_response, request, recorder)
+        self._check(request, recorder)
+        return response
+
+    def _check(self, request, recorder):
+        match = request.resolver_match
+        view = match.url_name if match else None
+        self.check_repeats(request, recorder.queries)
+        self.check_budget(request, view, len(recorder.queries))
+
+    @staticmethod
+    def check_repeats(request, queries):
+        duplicates = Counter((sql, params) for sql, params, origin in queries)
+        similar = Counter(sql for sql, params in duplicates)
+        for sql, count in Counter(sql for sql, params, origin in queries).items():
+            if count < 2:
+                continue
+            kind = "Duplicate" if similar[sql] == 1 else "Similar"
+            origins = sorted({origin for query_sql, params, origin in queries if query_sql == sql})
+            logger.warning(f"{kind} query made {count} times by {request.path} from {', '.join(origins)}: {sql}")
+
+    @staticmethod
+    def check_budget(request, view, count):
+        budget = settings.QUERY_BUDGETS.get(view)
+        if budget is None or count <= budget:
+            return
+        message = f"{request.path} made {count} queries, over the {view} view's budget of {budget}."
+        if settings.QUERY_BUDGET_ENFORCE:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='gamemove',
+            options={'ordering': ['game', 'x_coord', 'y_coord']},
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='board_snapshot',
+            field=models.CharField(default='.................................................', max_length=49),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='move_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# Copied rather than imported from game.engine so this migration keeps working if the engine changes.
+WIDTH = 7
+EMPTY_SNAPSHOT = "." * 49
+BATCH_SIZE = 500
+
+
+def backfill_board_snapshot(apps, schema_editor):
+    """Build board_snapshot and move_count from each game's GameMoves, with one query for each batch's moves."""
+    Game = apps.get_model("game", "Game")
+    GameMove = apps.get_model("game", "GameMove")
+
+    last_id = 0
+    while True:
+        games = list(Game.objects.filter(id__gt=last_id).order_by("id").only("id")[:BATCH_SIZE])
+        if not games:
+            return
+        spaces = {game.id: list(EMPTY_SNAPSHOT) for game in games}
+        move_counts = dict.fromkeys(spaces, 0)
+        moves = GameMove.objects.filter(game_id__in=spaces).values_list("game_id", "player", "x_coord", "y_coord")
+        for game_id, player, x, y in moves:
+            spaces[game_id][y * WIDTH + x] = player
+            move_counts[game_id] += 1
+        for game in games:
+            game.board_snapshot = "".join(spaces[game.id])
+            game.move_count = move_counts[game.id]
+        Game.objects.bulk_update(games, ["board_snapshot", "move_count"])
+        last_id = games[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0002_board_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_board_snapshot, migrations.RunPython.noop),
+    ]
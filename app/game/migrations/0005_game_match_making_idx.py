@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_game_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('state', 'match making')), fields=['id'], name='game_match_making_idx'),
+        ),
+    ]
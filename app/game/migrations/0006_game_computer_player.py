@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_game_match_making_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='computer_player',
+            field=models.CharField(blank=True, choices=[('1', 'player 1'), ('2', 'player 2')], max_length=10, null=True),
+        ),
+    ]
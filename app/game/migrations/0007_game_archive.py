@@ -0,0 +1,25 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_game_computer_player'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='game.game')),
+                ('moves', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='gamemove',
+            options={},
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:34
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_game_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='height',
+            field=models.PositiveSmallIntegerField(default=7, validators=[django.core.validators.MinValueValidator(3), django.core.validators.MaxValueValidator(15)]),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='width',
+            field=models.PositiveSmallIntegerField(default=7, validators=[django.core.validators.MinValueValidator(3), django.core.validators.MaxValueValidator(15)]),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='win_length',
+            field=models.PositiveSmallIntegerField(default=4, validators=[django.core.validators.MinValueValidator(3), django.core.validators.MaxValueValidator(15)]),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='board_snapshot',
+            field=models.CharField(default='.................................................', max_length=225),
+        ),
+        migrations.AddConstraint(
+            model_name='game',
+            constraint=models.CheckConstraint(check=models.Q(('height__gte', 3), ('height__lte', 15), ('width__gte', 3), ('width__lte', 15)), name='game_board_size'),
+        ),
+        migrations.AddConstraint(
+            model_name='game',
+            constraint=models.CheckConstraint(check=models.Q(('win_length__gte', 3), models.Q(('win_length__lte', models.F('width')), ('win_length__lte', models.F('height')), _connector='OR')), name='game_win_length'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_game_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='game',
+            constraint=models.CheckConstraint(check=models.Q(('computer_player__isnull', True), models.Q(('height', 7), ('width', 7), ('win_length', 4)), _connector='OR'), name='game_computer_standard_board'),
+        ),
+    ]
@@ -1,4 +1,11 @@
-from django.db import models
+from time import perf_counter
+
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+
+from . import metrics
+from .engine import Bitboard, EMPTY_SNAPSHOT, HEIGHT, STANDARD, WIDTH, WIN_LENGTH, get_geometry
 
 PLAYER_1 = "1"
 PLAYER_2 = "2"
@@ -7,11 +14,20 @@ PLAYER_CHOICES = [
     (PLAYER_2, "player 2"),
 ]
 
+# Limits for a game's width, height and win length. Archived moves are a byte per cell index, so boards can't have more
+# than 256 spaces.
+MIN_SIZE = 3
+MAX_SIZE = 15
+
+
+class MoveConflict(ValueError):
+    """The game was changed by another request after it was loaded, so the move wasn't made."""
+
 
 class Game(models.Model):
     """
     Game board is an (x, y) coordinate system with (0, 0) being the top-left corner.
-    (6, 6) represents the bottom-right corner.
+    (width - 1, height - 1) represents the bottom-right corner. The standard board is 7x7, four in a row to win:
 
     y
     0 _ _ _ _ _ _ _
@@ -23,7 +39,12 @@ class Game(models.Model):
     6 _ _ _ _ _ _ _
       0 1 2 3 4 5 6 x
 
-    A space with no associated GameMove is empty.
+    Games can be other sizes, from MIN_SIZE to MAX_SIZE spaces each way, and need win_length in a row to win. Choose
+    them when the game is created; they can't change once it has started.
+
+    A space with no associated GameMove is empty. The board is also denormalized into board_snapshot, one character
+    per space in row order, so showing the board doesn't need to load the GameMoves. Once a completed game is
+    archived its GameMoves are replaced by a GameArchive, see get_moves().
 
     Use integer sequence as ID, as usual in Django. Views must not let clients supply game ID since it is easily
     guessable.
@@ -39,40 +60,133 @@ class Game(models.Model):
     state = models.CharField(max_length=20, null=False, blank=False, default=STATE_MATCH_MAKING)
     next_player = models.CharField(max_length=10, null=False, blank=False, choices=PLAYER_CHOICES, default=PLAYER_1)
     winner = models.CharField(max_length=10, null=True, blank=True, choices=PLAYER_CHOICES)
-
-    _board = None  # This gets lazy loaded from GameMoves.
+    computer_player = models.CharField(max_length=10, null=True, blank=True, choices=PLAYER_CHOICES)
+    width = models.PositiveSmallIntegerField(
+        null=False, default=WIDTH, validators=[MinValueValidator(MIN_SIZE), MaxValueValidator(MAX_SIZE)],
+    )
+    height = models.PositiveSmallIntegerField(
+        null=False, default=HEIGHT, validators=[MinValueValidator(MIN_SIZE), MaxValueValidator(MAX_SIZE)],
+    )
+    win_length = models.PositiveSmallIntegerField(
+        null=False, default=WIN_LENGTH, validators=[MinValueValidator(MIN_SIZE), MaxValueValidator(MAX_SIZE)],
+    )
+    # Sized for the biggest board. save() gives new games the empty snapshot for their size.
+    board_snapshot = models.CharField(max_length=MAX_SIZE * MAX_SIZE, null=False, blank=False, default=EMPTY_SNAPSHOT)
+    move_count = models.PositiveSmallIntegerField(null=False, default=0)
+    version = models.PositiveIntegerField(null=False, default=0)  # Incremented on every change, see _commit_move().
+
+    _board = None  # This gets lazy loaded from board_snapshot.
+    _bitboard = None  # So does this. The rules engine works on it, _board is kept in step for templates.
 
     class Meta:
         ordering = ["id"]
+        indexes = [
+            # Match making only ever looks for waiting games, which are few, so only index those.
+            models.Index(fields=["id"], condition=models.Q(state="match making"), name="game_match_making_idx"),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(width__gte=MIN_SIZE, width__lte=MAX_SIZE, height__gte=MIN_SIZE, height__lte=MAX_SIZE),
+                name="game_board_size",
+            ),
+            models.CheckConstraint(
+                check=models.Q(win_length__gte=MIN_SIZE)
+                & (models.Q(win_length__lte=models.F("width")) | models.Q(win_length__lte=models.F("height"))),
+                name="game_win_length",
+            ),
+            # The computer player's search only knows the standard board.
+            models.CheckConstraint(
+                check=models.Q(computer_player__isnull=True)
+                | models.Q(width=WIDTH, height=HEIGHT, win_length=WIN_LENGTH),
+                name="game_computer_standard_board",
+            ),
+        ]
 
     def __str__(self):
         return f"Game {self.id} ({self.state})"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.move_count:
+            self.board_snapshot = self.get_geometry().empty_snapshot
+        super().save(*args, **kwargs)
+
+    def clean(self):
+        super().clean()
+        self.validate_dimensions(self.width, self.height, self.win_length)
+        if self.is_against_computer() and not self.is_standard_board():
+            raise ValidationError(
+                {"computer_player": "The computer only plays on the standard board."}, code="invalid",
+            )
+
+    @staticmethod
+    def validate_dimensions(width, height, win_length):
+        """Raise ValidationError if a game can't have these dimensions and win length."""
+        for name, value in (("width", width), ("height", height), ("win_length", win_length)):
+            if not MIN_SIZE <= value <= MAX_SIZE:
+                raise ValidationError(
+                    {name: f"Must be from {MIN_SIZE} to {MAX_SIZE}."}, code="invalid",
+                )
+        if win_length > max(width, height):
+            raise ValidationError({"win_length": "Must fit on the board."}, code="invalid")
+
+    def is_standard_board(self):
+        return (self.width, self.height, self.win_length) == (WIDTH, HEIGHT, WIN_LENGTH)
+
+    def get_geometry(self):
+        """Return the engine's Geometry for this game's dimensions and win length."""
+        return get_geometry(self.width, self.height, self.win_length)
+
     def get_board(self):
         """
         Load existing moves into a 2-dimensional list.
 
         Outer list is rows (y axis). Inner lists are columns (x axis). So refer to a space as board[y][x].
         """
-        if not self._board:
-            # Set up a blank board-
-            self._board = []
-            for x in range(0, 7):
-                self._board.append([])
-                for y in range(0, 7):
-                    self._board[x].append(None)
-
-            # Get existing moves
-            moves = self.gamemove_set.all()
-            for move in moves:
-                self._board[move.y_coord][move.x_coord] = move.player
+        if self._board is None:
+            self._board = self._get_bitboard().to_rows()
 
         return self._board
 
+    def get_board_spaces(self):
+        """
+        Return the board like get_board(), but with each space as a (player, playable) tuple.
+
+        playable is if the space can be chosen next, see legal_moves().
+        """
+        legal_moves = set(self.legal_moves())
+        return [
+            [(space, (x, y) in legal_moves) for x, space in enumerate(row)]
+            for y, row in enumerate(self.get_board())
+        ]
+
+    def legal_moves(self):
+        """Return the (x, y) coordinates of the spaces the next player can choose, none if the game is complete."""
+        if self.is_complete():
+            return []
+        return self._get_bitboard().legal_moves()
+
     def move(self, player, x, y):
         """
         Perform validation, register the move, check if game is complete, update game state and next player.
+
+        The move and the game are saved together. If the game was changed by another request since it was loaded,
+        nothing is saved, the game is reloaded and MoveConflict is raised.
         """
+        start = perf_counter()
+        try:
+            self._apply_move(player, x, y)
+        finally:
+            metrics.MOVE_SECONDS.observe(perf_counter() - start)
+        try:
+            self._commit_move(player, x, y)
+        except MoveConflict:
+            self.refresh_from_db()
+            self._board = None
+            self._bitboard = None
+            raise
+
+    def _apply_move(self, player, x, y):
+        """Perform validation and update the game in memory. Nothing is saved."""
         if player != self.next_player:
             # This is not the player you are looking for.
             raise ValueError("It's not your turn.")
@@ -99,119 +213,86 @@ class Game(models.Model):
             # The game is still going.
             self.next_player = PLAYER_2 if self.next_player == PLAYER_1 else PLAYER_1
 
+    def get_moves(self):
+        """Return (player, x, y) for each move in the order they were made, from the archive if there is one."""
+        try:
+            return self.archive.get_moves()
+        except GameArchive.DoesNotExist:
+            pass
+        # Sorted here rather than in the query, so prefetched moves can be used.
+        moves = sorted(self.gamemove_set.all(), key=lambda move: move.id)
+        return [(move.player, move.x_coord, move.y_coord) for move in moves]
+
     def is_complete(self):
         return self.state == self.STATE_COMPLETED
 
     def is_match_making(self):
         return self.state == self.STATE_MATCH_MAKING
 
-    def _record_move(self, player, x, y):
-        """Save a GameMove object representing this and update _board."""
-        GameMove.objects.create(
-            game=self,
-            player=player,
-            x_coord=x,
-            y_coord=y,
-        )
-        self._board[y][x] = player
+    def is_against_computer(self):
+        return self.computer_player is not None
 
-    def _is_winning_move(self, player, x, y):
-        """
-        Return if the player has made a winning move, having 4 or more in a row.
+    def _get_bitboard(self):
+        """Return the rules engine's view of the board, loading it from board_snapshot the first time."""
+        if self._bitboard is None:
+            self._bitboard = Bitboard.from_snapshot(self.board_snapshot, self.get_geometry())
+        return self._bitboard
 
-        The continuous counts in either direction should add up to 3 or more because they don't include the current
-        move.
-        """
-        def add(coord):
-            return coord + 1
-
-        def subtract(coord):
-            return coord - 1
-
-        def noop(coord):
-            return coord
-
-        # Check ↕
-        if self._count_continuous(player, x, y, noop, add) + \
-                self._count_continuous(player, x, y, noop, subtract) >= 3:
-            return True
-        # Check ↔
-        if self._count_continuous(player, x, y, add, noop) + \
-                self._count_continuous(player, x, y, subtract, noop) >= 3:
-            return True
-        # Check ⤢
-        if self._count_continuous(player, x, y, add, add) + \
-                self._count_continuous(player, x, y, subtract, subtract) >= 3:
-            return True
-        # Check ⤡
-        if self._count_continuous(player, x, y, subtract, add) + \
-                self._count_continuous(player, x, y, add, subtract) >= 3:
-            return True
-
-    def _count_continuous(self, player, x, y, x_callable, y_callable):
+    def _record_move(self, player, x, y):
+        """Update the board, snapshot and move count in memory."""
+        self._get_bitboard().play(player, x, y)
+        self.get_board()[y][x] = player
+        index = self.get_geometry().cell_index(x, y)
+        self.board_snapshot = self.board_snapshot[:index] + player + self.board_snapshot[index + 1:]
+        self.move_count += 1
+
+    def _commit_move(self, player, x, y):
         """
-        Return the number of continuous spaces the player has played from the coordinates.
+        Save a GameMove object representing this and the changed game fields in one transaction.
 
-        The direction to check is controlled by the x and y callables, which should take 1 coordinate arg and either
-        add 1, subtract 1, or make no change.
+        The game row is updated with a single UPDATE that only matches the version this move was made against, so two
+        requests racing to move can't both apply a turn. The loser raises MoveConflict and saves nothing.
         """
-        continuous_spaces = 0  # Do not include the starting space.
-        check_x = x
-        check_y = y
-        continuous = True
-        while continuous:
-            check_x = x_callable(check_x)
-            check_y = y_callable(check_y)
-            if not self._valid_coordinates(check_x, check_y):
-                # We're off the board now.
-                continuous = False
-            else:
-                if self._get_space_player(check_x, check_y) == player:
-                    continuous_spaces += 1
-                else:
-                    continuous = False
-
-        return continuous_spaces
+        with transaction.atomic():
+            games_updated = Game.objects.filter(id=self.id, version=self.version).update(
+                board_snapshot=self.board_snapshot,
+                move_count=self.move_count,
+                next_player=self.next_player,
+                state=self.state,
+                winner=self.winner,
+                version=self.version + 1,
+            )
+            if not games_updated:
+                raise MoveConflict("The game changed before your move was made. Please try again.")
+            GameMove.objects.create(
+                game=self,
+                player=player,
+                x_coord=x,
+                y_coord=y,
+            )
+        self.version += 1
+
+    def _is_winning_move(self, player, x, y):
+        """Return if the player has made a winning move, having win_length or more in a row."""
+        return self._get_bitboard().is_winning_move(player, x, y)
 
     def _get_space_player(self, x, y):
         """Return the player who chose this space, or None."""
-        b = self.get_board()
-        return b[y][x]
+        return self._get_bitboard().get(x, y)
 
     def _valid_coordinates(self, x, y):
         """Return if the coordinates are valid (they exist on the board)."""
-        return 0 <= x <= 6 and 0 <= y <= 6
+        return 0 <= x < self.width and 0 <= y < self.height
 
     def _is_continuous_from_side(self, x, y):
         """
         Return if the move is continuous from left or right.
         """
-        board = self.get_board()
-        row = board[y]
-
-        # Check continuous from left.
-        continuous_from_left = True
-        for check_x in range(0, x):
-            if row[check_x] is None:
-                continuous_from_left = False
-                break
-
-        # Check continuous from right.
-        continuous_from_right = True
-        for check_x in range(x+1, 7):
-            if row[check_x] is None:
-                continuous_from_right = False
-                break
-
-        return continuous_from_left or continuous_from_right
+        return self._get_bitboard().is_continuous_from_side(x, y)
 
     def _all_spaces_chosen(self):
-        """Return if all the spaces have been chosen."""
-        for x in range(0, 7):
-            for y in range(0, 7):
-                if self._get_space_player(x, y) is None:
-                    return False
-        return True
+        """Return if all the spaces have been chosen. Each move takes one, so that's when there's been a move each."""
+        return self.move_count == self.width * self.height
 
 
 class GameMove(models.Model):
@@ -221,10 +302,40 @@ class GameMove(models.Model):
     y_coord = models.SmallIntegerField(null=False, blank=False)
 
     class Meta:
-        ordering = ["game", "x_coord", "y_coord"]
+        # No ordering, so fetching a game's moves doesn't sort them. Order by id for the order they were made.
         constraints = [
             models.UniqueConstraint(fields=['game', 'x_coord', 'y_coord'], name='unique_game_move'),
         ]
 
     def __str__(self):
         return f"Player {self.player}, ({self.x_coord}, {self.y_coord})"
+
+
+class GameArchive(models.Model):
+    """
+    The moves of a completed game, kept in one compact row once its GameMoves have been deleted. See archive.py.
+
+    moves holds the cell index (y * width + x) of each move, one byte each, in the order they were made. Players take
+    turns starting with player 1, so the player of each move isn't stored.
+    """
+    game = models.OneToOneField("Game", primary_key=True, on_delete=models.CASCADE, related_name="archive")
+    moves = models.BinaryField(null=False)
+
+    def __str__(self):
+        return f"Archive of game {self.game_id}"
+
+    @staticmethod
+    def encode_moves(moves, geometry=STANDARD):
+        """Return the moves field for (player, x, y) moves in the order they were made, on a board of that geometry."""
+        for ply, (player, x, y) in enumerate(moves):
+            if player != (PLAYER_1 if ply % 2 == 0 else PLAYER_2):
+                raise ValueError("Moves must alternate players, starting with player 1.")
+        return bytes(geometry.cell_index(x, y) for player, x, y in moves)
+
+    def get_moves(self):
+        """Return (player, x, y) for each move in the order they were made."""
+        geometry = self.game.get_geometry()
+        return [
+            (PLAYER_1 if ply % 2 == 0 else PLAYER_2, *geometry.cell_coordinates(index))
+            for ply, index in enumerate(bytes(self.moves))
+        ]
@@ -0,0 +1,274 @@
+"""
+Game change notifications, from Django to the websocket server.
+
+Django publishes an event whenever a game changes, and each websocket server worker listens for them. How events get
+across is up to the backend named by the GAME_NOTIFICATION_BACKEND setting:
+
+- PostgresBackend: PostgreSQL NOTIFY/LISTEN on the game_changes channel. The default.
+- UnixSocketBackend: a broker process on a Unix domain socket (run the notification_broker command), for single host
+  deployments which would rather keep pub/sub traffic off the database, or don't use PostgreSQL at all.
+- InMemoryBackend: within one process, for tests.
+
+Backends only publish from Django, and only listen from the websocket server, which doesn't load Django settings, so
+anything the listening side needs is passed to the constructor.
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "game_changes"
+RECONNECT_DELAY = 0.5  # Seconds before a listener's first reconnect attempt, doubled on each failure.
+MAX_RECONNECT_DELAY = 30
+PUBLISH_TIMEOUT = 1  # Seconds the Unix socket broker has to take each event, so a stalled one can't hold up requests.
+
+
+def notify_game_event(game, client_id, player=None, x=None, y=None):
+    """
+    Publish a game change once the current transaction commits, so listeners never hear about changes which are
+    rolled back.
+
+    The event carries the move, if there was one, and the resulting game state so clients can patch their board
+    instead of fetching it again. ply is the number of moves made, so clients can tell if they missed one, and version
+    lets them ask for a board at least that new. client_id says which client made the change, see
+    tokens.get_client_id().
+
+    The change is already saved by the time the event is sent, so failing to send it is logged rather than raised.
+    Clients still get the change with their next board.
+    """
+    event = {
+        'game_id': game.id,
+        'client_id': client_id,
+        'x': x,
+        'y': y,
+        'player': player,
+        'next_player': game.next_player,
+        'state': game.state,
+        'winner': game.winner,
+        'ply': game.move_count,
+        'version': game.version,
+    }
+    transaction.on_commit(lambda: get_backend().publish(event), robust=True)
+
+
+_backend = None
+
+
+def get_backend():
+    """Return Django's notification backend, as configured in settings."""
+    global _backend
+    if _backend is None:
+        _backend = load_backend(
+            settings.GAME_NOTIFICATION_BACKEND,
+            database_url=settings.DATABASE_URL,
+            socket_path=settings.GAME_NOTIFICATION_SOCKET,
+        )
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting in ('GAME_NOTIFICATION_BACKEND', 'GAME_NOTIFICATION_SOCKET'):
+        _backend = None
+
+
+def load_backend(path, **options):
+    """Return an instance of the backend class at the dotted path."""
+    return import_string(path)(**options)
+
+
+async def listen_forever(backend, handle_event, name, on_connect=None, on_disconnect=None):
+    """
+    Pass every event from the backend to handle_event until cancelled, reconnecting with backoff when the connection is
+    lost. on_connect() is called each time it connects, and on_disconnect(error) each time the connection is lost. name
+    says what's listening, for the logs.
+    """
+    delay = RECONNECT_DELAY
+
+    def connected():
+        nonlocal delay
+        delay = RECONNECT_DELAY
+        if on_connect:
+            on_connect()
+
+    while True:
+        try:
+            async for event in backend.listen(on_connect=connected):
+                handle_event(event)
+            raise ConnectionError("The notification backend stopped listening.")
+        except Exception as e:
+            if on_disconnect:
+                on_disconnect(e)
+            # Usually a database error or OSError, but the event loop can raise its own errors for a dead socket.
+            logger.warning(f"Lost {name} connection, reconnecting in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+class NotificationBackend:
+    def __init__(self, database_url=None, socket_path=None):
+        self.database_url = database_url
+        self.socket_path = socket_path
+
+    def publish(self, event):
+        """Send an event, a JSON serializable dict, to every listener."""
+        raise NotImplementedError
+
+    def listen(self, on_connect=None):
+        """
+        Return an async iterator of every event published from now on. Call on_connect once connected.
+
+        Raises an exception if the connection is lost. Anything published while disconnected is lost too.
+        """
+        raise NotImplementedError
+
+
+class PostgresBackend(NotificationBackend):
+    """PostgreSQL NOTIFY and LISTEN. Publishes through Django's connection, listens with aiopg on database_url."""
+
+    def publish(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, json.dumps(event)])
+
+    async def listen(self, on_connect=None):
+        # Imported here so the other backends don't need aiopg.
+        import aiopg
+
+        async with aiopg.connect(self.database_url) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"LISTEN {CHANNEL}")
+            if on_connect:
+                on_connect()
+            while True:
+                notification = await conn.notifies.get()
+                yield json.loads(notification.payload)
+
+
+class UnixSocketBackend(NotificationBackend):
+    """
+    A broker on a Unix domain socket at socket_path, see run_broker().
+
+    Each Django thread keeps a connection open to publish on, and reconnects once if the broker has gone away or
+    doesn't take an event within PUBLISH_TIMEOUT.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    def publish(self, event):
+        line = json.dumps(event).encode() + b"\n"
+        try:
+            self._publisher().sendall(line)
+        except OSError:
+            self._disconnect()
+            try:
+                self._publisher().sendall(line)
+            except OSError:
+                self._disconnect()
+                raise
+
+    def _publisher(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(PUBLISH_TIMEOUT)
+            sock.connect(self.socket_path)
+            sock.sendall(b"publish\n")
+            self._local.sock = sock
+        return sock
+
+    def _disconnect(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    async def listen(self, on_connect=None):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            writer.write(b"subscribe\n")
+            await writer.drain()
+            if on_connect:
+                on_connect()
+            while line := await reader.readline():
+                yield json.loads(line)
+            raise ConnectionError("The notification broker closed the connection.")
+        finally:
+            writer.close()
+
+
+class InMemoryBackend(NotificationBackend):
+    """Events stay within the process. Everything published is also kept in events, for tests to check."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+        self._listeners = set()  # (event loop, queue) for each listener.
+
+    def publish(self, event):
+        self.events.append(event)
+        for loop, queue in list(self._listeners):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    async def listen(self, on_connect=None):
+        listener = (asyncio.get_running_loop(), asyncio.Queue())
+        self._listeners.add(listener)
+        try:
+            if on_connect:
+                on_connect()
+            while True:
+                yield await listener[1].get()
+        finally:
+            self._listeners.discard(listener)
+
+
+# Subscribers the broker stops sending to once this many bytes are waiting for them.
+BROKER_WRITE_BUFFER_LIMIT = 1024 * 1024
+
+
+async def run_broker(path):
+    """
+    Run a broker for UnixSocketBackend on the socket at path, until cancelled.
+
+    Connections start with a line saying whether they "publish" or "subscribe". Each line published after that is an
+    event, and is passed on to every subscriber. Subscribers which fall too far behind are disconnected rather than
+    letting the broker's memory grow; their listener reconnects and refreshes its clients.
+    """
+    subscribers = set()
+
+    async def handle(reader, writer):
+        role = await reader.readline()
+        if role == b"subscribe\n":
+            subscribers.add(writer)
+            try:
+                # Subscribers don't send anything, this just waits for them to go away.
+                await reader.read()
+            finally:
+                subscribers.discard(writer)
+                writer.close()
+        elif role == b"publish\n":
+            while line := await reader.readline():
+                for subscriber in list(subscribers):
+                    if subscriber.transport.get_write_buffer_size() > BROKER_WRITE_BUFFER_LIMIT:
+                        subscribers.discard(subscriber)
+                        subscriber.close()
+                    else:
+                        subscriber.write(line)
+            writer.close()
+        else:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, path)
+    async with server:
+        await server.serve_forever()
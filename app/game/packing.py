@@ -0,0 +1,114 @@
+"""
+A compact packed file format for games, used by the export_games and import_games commands.
+
+A file is a header followed by one fixed-width record per game, so the number of games is the file size over the
+record size, and any game can be found without reading the ones before it. All integers are little-endian.
+
+Header, 8 bytes: the magic bytes b"SSGAMES" then the format version.
+
+Only games on the standard board fit in a record, so other sizes can't be packed.
+
+Record, 64 bytes:
+    id               int64
+    state            uint8, an index into STATES
+    winner           uint8, 0 for none or the player number
+    computer_player  uint8, 0 for none or the player number
+    move_count       uint8
+    moves            49 bytes, the cell index (y * WIDTH + x) of each move in the order they were made, padded with
+                     NO_MOVE. Players take turns starting with player 1, so the player of each move isn't stored.
+    padding          3 bytes, so records stay 8 byte aligned
+"""
+import struct
+
+from .engine import Bitboard, CELLS, cell_coordinates
+from .models import Game, GameArchive, GameMove, PLAYER_1, PLAYER_2
+
+MAGIC = b"SSGAMES"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<7sB")
+RECORD = struct.Struct(f"<qBBBB{CELLS}s3x")
+NO_MOVE = 0xFF
+
+STATES = (Game.STATE_MATCH_MAKING, Game.STATE_IN_PROGRESS, Game.STATE_COMPLETED)
+PLAYERS = (None, PLAYER_1, PLAYER_2)
+
+
+class PackingError(ValueError):
+    """The file or game can't be packed or unpacked."""
+
+
+def write_header(file):
+    file.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+
+
+def read_header(file):
+    """Read and check the header, leaving the file at the first record."""
+    data = file.read(HEADER.size)
+    if len(data) != HEADER.size:
+        raise PackingError("The file is too short to be a packed games file.")
+    magic, version = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise PackingError("The file isn't a packed games file.")
+    if version != FORMAT_VERSION:
+        raise PackingError(f"Packed games format version {version} isn't supported.")
+
+
+def pack_game(game, moves):
+    """Return the record for a game and its (player, x, y) moves, in the order they were made."""
+    if not game.is_standard_board():
+        raise PackingError(f"Game {game.id} isn't on the standard board, so it can't be packed.")
+    try:
+        cells = GameArchive.encode_moves(moves)
+    except ValueError:
+        raise PackingError(f"Game {game.id} doesn't alternate players, so it can't be packed.")
+    return RECORD.pack(
+        game.id,
+        STATES.index(game.state),
+        PLAYERS.index(game.winner),
+        PLAYERS.index(game.computer_player),
+        len(cells),
+        cells.ljust(CELLS, bytes([NO_MOVE])),
+    )
+
+
+def unpack_game(record):
+    """
+    Return an unsaved Game and its unsaved GameMoves from a record.
+
+    The board snapshot, move count and next player are rebuilt from the moves, each of which must be legal, and the
+    state and winner must be the ones the moves lead to.
+    """
+    game_id, state, winner, computer_player, move_count, cells = record
+    try:
+        game = Game(id=game_id, state=STATES[state], winner=PLAYERS[winner], computer_player=PLAYERS[computer_player])
+    except IndexError:
+        raise PackingError(f"Game {game_id} has an invalid state or player.")
+    if move_count > CELLS:
+        raise PackingError(f"Game {game_id} has more moves than the board has spaces.")
+
+    bitboard = Bitboard()
+    moves = []
+    winner = None
+    for ply, index in enumerate(cells[:move_count]):
+        player = PLAYERS[ply % 2 + 1]
+        if winner is not None:
+            raise PackingError(f"Game {game_id} has moves after it was won.")
+        if index >= CELLS:
+            raise PackingError(f"Game {game_id} has an invalid move.")
+        x, y = cell_coordinates(index)
+        if not bitboard.is_legal(x, y):
+            # Including a space which was already chosen, which would otherwise only fail when inserted.
+            raise PackingError(f"Game {game_id} has an invalid move.")
+        bitboard.play(player, x, y)
+        if bitboard.is_winning_move(player, x, y):
+            winner = player
+        moves.append(GameMove(game=game, player=player, x_coord=x, y_coord=y))
+
+    complete = winner is not None or move_count == CELLS
+    if game.is_complete() != complete or game.winner != winner or (game.is_match_making() and move_count):
+        raise PackingError(f"Game {game_id} has a state or winner which doesn't match its moves.")
+
+    game.board_snapshot = bitboard.to_snapshot()
+    game.move_count = move_count
+    game.next_player = PLAYERS[move_count % 2 + 1]
+    return game, moves
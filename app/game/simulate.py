@@ -0,0 +1,108 @@
+"""
+Self-play simulation of many games at once with NumPy, for rules testing, AI tuning and generating training data.
+
+A batch of boards is stepped together: every ply, each unfinished board gets one move, chosen by a policy from its
+legal moves. Boards use the engine's bitboard layout as uint64 arrays, legal moves come from each row's side stacking
+frontiers like engine.Bitboard's, and wins are mask tests against the lines through the space just played. Batches are
+spread over a process pool, each with its own seed, so results depend only on the seed and batch size.
+
+Like engine, nothing here touches Django, so the pool's processes don't need it either.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .engine import CELLS, HEIGHT, WIDTH, WIN_MASKS_BY_CELL
+
+CELL_BITS = np.uint64(1) << np.arange(CELLS, dtype=np.uint64)
+
+# The lines through each cell, padded with a mask no board can match, since it has a bit outside the board.
+NO_LINE = np.uint64(1 << 63)
+LINES_BY_CELL = np.full((CELLS, max(len(masks) for masks in WIN_MASKS_BY_CELL)), NO_LINE, dtype=np.uint64)
+for _index, _masks in enumerate(WIN_MASKS_BY_CELL):
+    LINES_BY_CELL[_index, :len(_masks)] = _masks
+
+ROWS = np.arange(HEIGHT)
+
+
+def random_policy(rng, own, other, candidates, legal):
+    """
+    Choose uniformly between the legal moves.
+
+    This is the interface for policies: rng is the batch's numpy Generator, own and other are the stones of the player
+    to move and their opponent as uint64 bitboards, one per board. candidates is an array of shape (boards,
+    2 * HEIGHT) of cell indexes, the left end of each row then the right end, and legal marks which of them can be
+    played. Return the position in candidates of the move to play on each board, which must be legal.
+
+    Policies are sent to the pool's processes, so must be module level functions.
+    """
+    scores = rng.random(candidates.shape)
+    scores[~legal] = -1
+    return scores.argmax(axis=1)
+
+
+def simulate_batch(games, seed, policy=random_policy):
+    """
+    Play games to the end. Return (winners, move counts, moves).
+
+    winners is 0 for a draw or the player number, and moves has a row per game of the cell index of each move in the
+    order they were made, padded with 0xFF. Player 1 moves first.
+    """
+    rng = np.random.default_rng(seed)
+    stones = np.zeros((2, games), dtype=np.uint64)
+    left = np.zeros((games, HEIGHT), dtype=np.int8)
+    right = np.full((games, HEIGHT), WIDTH - 1, dtype=np.int8)
+    winners = np.zeros(games, dtype=np.uint8)
+    moves = np.full((games, CELLS), 0xFF, dtype=np.uint8)
+    playing = np.arange(games)
+
+    for ply in range(CELLS):
+        mover = ply % 2
+        row_left = left[playing]
+        row_right = right[playing]
+        candidates = np.concatenate([ROWS * WIDTH + row_left, ROWS * WIDTH + row_right], axis=1)
+        open_rows = row_left <= row_right
+        # A row with one space left has it at both ends; only offer it once.
+        legal = np.concatenate([open_rows, open_rows & (row_right != row_left)], axis=1)
+
+        choices = policy(rng, stones[mover, playing], stones[1 - mover, playing], candidates, legal)
+        boards = np.arange(len(playing))
+        if not legal[boards, choices].all():
+            raise ValueError("The policy chose an illegal move.")
+        cells = candidates[boards, choices]
+        rows = choices % HEIGHT
+        from_left = choices < HEIGHT
+        left[playing[from_left], rows[from_left]] += 1
+        right[playing[~from_left], rows[~from_left]] -= 1
+
+        stones[mover, playing] |= CELL_BITS[cells]
+        moves[playing, ply] = cells
+
+        lines = LINES_BY_CELL[cells]
+        won = ((stones[mover, playing][:, None] & lines) == lines).any(axis=1)
+        winners[playing[won]] = mover + 1
+        playing = playing[~won]
+        if not len(playing):
+            break
+
+    move_counts = (moves != 0xFF).sum(axis=1).astype(np.uint8)
+    return winners, move_counts, moves
+
+
+def simulate(games, batch_size=10_000, processes=None, seed=0, policy=random_policy):
+    """
+    Play games in batches across a pool of processes (None for one per CPU, 0 to play in this process). Return
+    (winners, move counts, moves) like simulate_batch(), in batch order.
+    """
+    sizes = [min(batch_size, games - start) for start in range(0, games, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if processes == 0:
+        results = [simulate_batch(size, batch_seed, policy) for size, batch_seed in zip(sizes, seeds)]
+    else:
+        # Spawn rather than fork, since the caller may have threads of its own, as in bot.py.
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(simulate_batch, sizes, seeds, [policy] * len(sizes)))
+    if not results:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8), np.zeros((0, CELLS), dtype=np.uint8)
+    return tuple(np.concatenate(parts) for parts in zip(*results))
@@ -0,0 +1,11 @@
+from django import template
+
+from ..fragments import render_board
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def board(context, game, player):
+    """Render the game's board for the player, from the fragment cache if possible."""
+    return render_board(context.request, game, player)
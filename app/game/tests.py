@@ -1,9 +1,44 @@
-from django.test import TestCase
-from game.models import Game, GameMove, PLAYER_1, PLAYER_2
+import asyncio
+import json
+import os
+import random
+import tempfile
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from django.conf import settings
+from django.core.cache.backends.base import memcache_key_warnings
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, modify_settings, override_settings
+from django.urls import include, path, reverse
+from django.utils.html import escapejs
+from game import (
+    ai, archive, benchmarks, bot, cache, changes, engine, fragments, listener, matchmaking, metrics, notifications,
+    packing, views, websocket,
+)
+from game import urls as game_urls
+from game.engine import Bitboard
+from game.listener import GameChangesListener
+from game.matchmaking import join_or_create_game
+from game.middleware import QueryBudgetExceeded
+from game.models import Game, GameArchive, GameMove, MoveConflict, PLAYER_1, PLAYER_2
+from game.tokens import GameTokenResolver, make_game_token
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class GameTestCase(TestCase):
     def setUp(self):
+        # Test databases reuse game IDs, so games cached by other tests would get in the way.
+        cache.get_cache().clear()
         self.game = Game.objects.create()
 
     def test_move(self):
@@ -158,10 +193,42 @@ class GameTestCase(TestCase):
                     x_coord=x,
                     y_coord=y,
                 )
+        # The board is read from the snapshot, so fabricate that too.
+        self.game.board_snapshot = PLAYER_2 * 48 + engine.EMPTY_SPACE
+        self.game.move_count = 48
         self.game.move(PLAYER_1, 6, 6)
         self.assertTrue(self.game.is_complete())
         self.assertEqual(self.game.winner, None)
 
+    def test_five_in_a_row(self):
+        """Test a bigger board needs its own win length in a row, and fills up at its own size."""
+        game = Game.objects.create(width=15, height=15, win_length=5)
+        self.assertEqual(game.board_snapshot, engine.EMPTY_SPACE * 225)
+        for y in range(4):
+            game.move(PLAYER_1, 0, y)
+            game.move(PLAYER_2, 14, y)
+        self.assertFalse(game.is_complete())
+        game.move(PLAYER_1, 0, 4)  # Win!
+        self.assertEqual(game.winner, PLAYER_1)
+        game = Game.objects.get(id=game.id)
+        self.assertEqual(game.get_board()[4][0], PLAYER_1)
+        self.assertEqual(len(game.get_board()[0]), 15)
+        with self.assertRaises(ValueError):
+            Game.objects.create(width=3, height=3, win_length=3).move(PLAYER_1, 3, 0)
+
+    def test_dimensions_validation(self):
+        """Test boards must be from MIN_SIZE to MAX_SIZE each way, with a win length that fits."""
+        Game(width=15, height=3, win_length=15).full_clean()
+        for dimensions in ((16, 7, 4), (7, 2, 3), (7, 7, 8), (7, 7, 2)):
+            with self.subTest(dimensions=dimensions), self.assertRaises(ValidationError):
+                Game(width=dimensions[0], height=dimensions[1], win_length=dimensions[2]).full_clean()
+        # The computer only plays on the standard board.
+        Game(computer_player=PLAYER_2).full_clean()
+        with self.assertRaises(ValidationError):
+            Game(width=9, height=9, win_length=5, computer_player=PLAYER_2).full_clean()
+        with self.assertRaises(IntegrityError):
+            Game.objects.create(width=9, height=9, win_length=5, computer_player=PLAYER_2)
+
     def test_move_in_complete_game(self):
         """Test a move in a game that is complete."""
         self.game.move(PLAYER_1, 0, 0)
@@ -173,3 +240,1109 @@ class GameTestCase(TestCase):
         self.game.move(PLAYER_1, 0, 2)  # Win!
         with self.assertRaises(ValueError):
             self.game.move(PLAYER_2, 6, 3)
+
+    def test_board_snapshot(self):
+        """Test moves are saved to the snapshot and the board is loaded from it without GameMoves."""
+        self.game.move(PLAYER_1, 0, 0)
+        self.game.move(PLAYER_2, 6, 1)
+        game = Game.objects.get(id=self.game.id)
+        self.assertEqual(game.move_count, 2)
+        with self.assertNumQueries(0):
+            board = game.get_board()
+        self.assertEqual(board[0][0], PLAYER_1)
+        self.assertEqual(board[1][6], PLAYER_2)
+        self.assertIsNone(board[3][3])
+
+    def test_empty_board_is_loaded_once(self):
+        """Test an empty board isn't treated as not loaded."""
+        self.assertIs(self.game.get_board(), self.game.get_board())
+
+    def test_legal_moves(self):
+        """Test legal moves are the row ends while playing, and none once complete."""
+        self.game.move(PLAYER_1, 0, 0)
+        self.assertIn((1, 0), self.game.legal_moves())
+        self.assertNotIn((0, 0), self.game.legal_moves())
+        self.game.state = Game.STATE_COMPLETED
+        self.assertEqual(self.game.legal_moves(), [])
+
+    def test_board_forms_only_for_legal_spaces(self):
+        """Test the board only has move forms for the spaces which can be played."""
+        self.client.get(reverse("game:index"))
+        response = self.client.get(reverse("game:board"))
+        self.assertContains(response, "<form", count=2 * engine.HEIGHT)
+
+    def test_board_not_modified(self):
+        """Test the board is only rendered again once the game has changed."""
+        self.client.get(reverse("game:index"))
+        response = self.client.get(reverse("game:board"))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with mock.patch('game.views.render') as render:
+            response = self.client.get(reverse("game:board"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        render.assert_not_called()
+
+        game = Game.objects.get(id=self.client.session['game_id'])
+        game.move(game.next_player, 0, 0)
+        response = self.client.get(reverse("game:board"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_index_board_etag(self):
+        """Test the page's board ETag matches the board, so a refresh on the first websocket connection is cheap."""
+        response = self.client.get(reverse("game:index"))
+        self.assertContains(response, f'let boardEtag = "{escapejs(response.context["board_etag"])}";')
+        response = self.client.get(reverse("game:board"), HTTP_IF_NONE_MATCH=response.context['board_etag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_index_token(self):
+        """Test the page's websocket token has the session's client ID, not its session key."""
+        response = self.client.get(reverse('game:index'))
+        game_id, client_id = GameTokenResolver(settings.SECRET_KEY).resolve(response.context['websocket_token'])
+        self.assertEqual((game_id, client_id), (self.client.session['game_id'], self.client.session['client_id']))
+        self.assertNotIn(self.client.session.session_key, response.content.decode())
+
+    def test_move_conflict(self):
+        """Test a move made against a stale copy of the game is rejected without saving anything."""
+        stale_game = Game.objects.get(id=self.game.id)
+        self.game.move(PLAYER_1, 0, 0)
+        with self.assertRaises(MoveConflict):
+            stale_game.move(PLAYER_1, 0, 1)
+        self.assertEqual(GameMove.objects.filter(game=self.game).count(), 1)
+        # The stale copy was reloaded, so it can carry on.
+        self.assertEqual(stale_game.next_player, PLAYER_2)
+        stale_game.move(PLAYER_2, 0, 1)
+        self.assertEqual(stale_game.version, 2)
+
+    def test_move_queries(self):
+        """Test a move is a conditional game update and a GameMove insert, wrapped in a savepoint."""
+        with self.assertNumQueries(4):
+            self.game.move(PLAYER_1, 0, 0)
+
+
+class BitboardTestCase(SimpleTestCase):
+    def test_win_masks(self):
+        """Test the number of lines of 4 on a 7x7 board: 28 across, 28 down and 16 on each diagonal."""
+        self.assertEqual(len(engine.WIN_MASKS), 88)
+        self.assertTrue(all(bin(mask).count("1") == engine.WIN_LENGTH for mask in engine.WIN_MASKS))
+
+    def test_geometry(self):
+        """Test each space's lines are bounded by the win length, not the board size."""
+        geometry = engine.get_geometry(15, 15, 5)
+        self.assertIs(geometry, engine.get_geometry(15, 15, 5))
+        self.assertEqual(len(geometry.win_masks), 11 * 15 * 2 + 11 * 11 * 2)
+        self.assertEqual(max(len(masks) for masks in geometry.win_masks_by_cell), 4 * 5)
+        bitboard = Bitboard.from_moves([(PLAYER_1, x, 7) for x in (0, 1, 2, 4, 3)], geometry)
+        self.assertTrue(bitboard.is_winning_move(PLAYER_1, 3, 7))
+        self.assertEqual(bitboard.left[7], 5)
+        self.assertEqual(Bitboard.from_snapshot(bitboard.to_snapshot(), geometry).left, bitboard.left)
+
+    def test_get(self):
+        """Test reading back stones by player."""
+        bitboard = Bitboard.from_moves([(PLAYER_1, 0, 0), (PLAYER_2, 6, 6)])
+        self.assertEqual(bitboard.get(0, 0), PLAYER_1)
+        self.assertEqual(bitboard.get(6, 6), PLAYER_2)
+        self.assertIsNone(bitboard.get(3, 3))
+
+    def test_is_legal(self):
+        """Test side stacking from both ends of a row."""
+        bitboard = Bitboard()
+        self.assertTrue(bitboard.is_legal(0, 3))
+        self.assertTrue(bitboard.is_legal(6, 3))
+        self.assertFalse(bitboard.is_legal(1, 3))
+        bitboard.play(PLAYER_1, 0, 3)
+        self.assertFalse(bitboard.is_legal(0, 3))
+        self.assertTrue(bitboard.is_legal(1, 3))
+        self.assertFalse(bitboard.is_legal(1, 4))
+
+    def test_legal_moves(self):
+        """Test the frontiers follow moves from both sides until a row is full."""
+        bitboard = Bitboard()
+        self.assertEqual(len(bitboard.legal_moves()), 2 * engine.HEIGHT)
+        for x in (0, 6, 1, 5, 2, 4):
+            bitboard.play(PLAYER_1, x, 2)
+        self.assertEqual([move for move in bitboard.legal_moves() if move[1] == 2], [(3, 2)])
+        self.assertTrue(bitboard.is_legal(3, 2))
+        bitboard.play(PLAYER_1, 3, 2)
+        self.assertFalse([move for move in bitboard.legal_moves() if move[1] == 2])
+        self.assertEqual(sorted(bitboard.legal_moves()), sorted(Bitboard.from_snapshot(bitboard.to_snapshot()).legal_moves()))
+
+    def test_legal_moves_matches_masks(self):
+        """Test the frontiers agree with legal moves worked out from the occupied mask."""
+        bitboard = Bitboard.from_moves([(PLAYER_1, 0, 0), (PLAYER_2, 6, 0), (PLAYER_1, 1, 0), (PLAYER_2, 0, 4)])
+        self.assertEqual(
+            sorted(engine.cell_index(x, y) for x, y in bitboard.legal_moves()),
+            sorted(engine.legal_moves(bitboard.occupied)),
+        )
+
+    def test_is_winning_move_diagonal(self):
+        """Test a ⤢ line is found from its middle."""
+        bitboard = Bitboard.from_moves([(PLAYER_1, 0, 6), (PLAYER_1, 1, 5), (PLAYER_1, 3, 3), (PLAYER_1, 2, 4)])
+        self.assertTrue(bitboard.is_winning_move(PLAYER_1, 2, 4))
+        self.assertFalse(bitboard.is_winning_move(PLAYER_2, 2, 4))
+
+    def test_is_full(self):
+        """Test a full board."""
+        bitboard = Bitboard()
+        for y in range(engine.HEIGHT):
+            for x in range(engine.WIDTH):
+                self.assertFalse(bitboard.is_full())
+                bitboard.play(PLAYER_1 if (x + y) % 2 else PLAYER_2, x, y)
+        self.assertTrue(bitboard.is_full())
+
+
+class GameChangesListenerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.listener = GameChangesListener(notifications.InMemoryBackend())
+
+    def test_dispatch_to_game_subscribers_only(self):
+        """Test a notification only reaches the queues subscribed to its game."""
+        queue = self.listener.subscribe(1)
+        other_queue = self.listener.subscribe(2)
+        self.listener.dispatch({'game_id': 1, 'client_id': 'abc', 'ply': 3})
+        self.assertEqual(
+            queue.get_nowait(), {'game_id': 1, 'client_id': 'abc', 'ply': 3, 'received_at': mock.ANY})
+        self.assertTrue(other_queue.empty())
+
+    def test_unsubscribe(self):
+        """Test unsubscribing the last queue for a game forgets the game."""
+        queue = self.listener.subscribe(1)
+        self.listener.unsubscribe(1, queue)
+        self.listener.dispatch({'game_id': 1, 'client_id': 'abc'})
+        self.assertTrue(queue.empty())
+        self.assertEqual(self.listener._subscribers, {})
+
+    def test_malformed_notification(self):
+        """Test a malformed notification is ignored."""
+        queue = self.listener.subscribe(1)
+        with self.assertLogs("game.listener", level="WARNING"):
+            self.listener.dispatch({'client_id': 'abc'})
+        self.assertTrue(queue.empty())
+
+    def test_events_since(self):
+        """Test recent events are kept for reconnecting clients, as long as none are missing."""
+        self.assertIsNone(self.listener.events_since(1, 0))
+        for version in range(1, listener.RECENT_EVENTS + 3):
+            self.listener.dispatch({'game_id': 1, 'client_id': 'abc', 'version': version})
+        latest = listener.RECENT_EVENTS + 2
+        self.assertEqual([event['version'] for event in self.listener.events_since(1, latest - 2)], [latest - 1, latest])
+        self.assertEqual(self.listener.events_since(1, latest), [])
+        self.assertEqual(len(self.listener.events_since(1, 2)), listener.RECENT_EVENTS)
+        self.assertIsNone(self.listener.events_since(1, 1))
+
+    async def test_run(self):
+        """Test events published to the backend reach the game's subscribers."""
+        queue = self.listener.subscribe(1)
+        task = asyncio.create_task(self.listener.run())
+        try:
+            await asyncio.sleep(0)
+            self.listener.backend.publish({'game_id': 1, 'client_id': 'abc'})
+            self.assertEqual(
+                await asyncio.wait_for(queue.get(), 1), {'game_id': 1, 'client_id': 'abc', 'received_at': mock.ANY})
+        finally:
+            task.cancel()
+
+
+@override_settings(GAME_NOTIFICATION_BACKEND='game.notifications.InMemoryBackend')
+class NotificationsTestCase(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        notifications.get_backend().events.clear()
+
+    def test_published_on_commit(self):
+        """Test events are only published once the transaction commits."""
+        game = Game.objects.create(state=Game.STATE_IN_PROGRESS)
+        with self.captureOnCommitCallbacks(execute=True):
+            game.move(PLAYER_1, 0, 0)
+            notifications.notify_game_event(game, 'abc', PLAYER_1, 0, 0)
+            self.assertEqual(notifications.get_backend().events, [])
+        self.assertEqual(notifications.get_backend().events, [{
+            'game_id': game.id, 'client_id': 'abc', 'x': 0, 'y': 0, 'player': PLAYER_1,
+            'next_player': PLAYER_2, 'state': Game.STATE_IN_PROGRESS, 'winner': None, 'ply': 1, 'version': 1,
+        }])
+
+    def test_move_view(self):
+        """Test a move through the views is published."""
+        self.client.get(reverse("game:index"))
+        game = Game.objects.get(id=self.client.session['game_id'])
+        game.state = Game.STATE_IN_PROGRESS
+        game.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("game:move"), {'x': 0, 'y': 0})
+        event, = notifications.get_backend().events
+        self.assertEqual((event['game_id'], event['x'], event['y'], event['ply']), (game.id, 0, 0, 1))
+
+    def test_broker_down(self):
+        """Test a move is still made when its event can't be sent."""
+        self.client.get(reverse("game:index"))
+        Game.objects.update(state=Game.STATE_IN_PROGRESS)
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            GAME_NOTIFICATION_BACKEND='game.notifications.UnixSocketBackend',
+            GAME_NOTIFICATION_SOCKET=f"{directory}/missing.sock",
+        ), self.assertLogs(level='ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("game:move"), {'x': 0, 'y': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Game.objects.get().move_count, 1)
+
+    async def test_unix_socket_broker(self):
+        """Test events published to the broker reach a listener."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/broker.sock"
+            broker = asyncio.create_task(notifications.run_broker(path))
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            connected = asyncio.Event()
+            events = notifications.UnixSocketBackend(socket_path=path).listen(on_connect=connected.set)
+            listening = asyncio.create_task(anext(events))
+            backend = notifications.UnixSocketBackend(socket_path=path)
+            try:
+                await asyncio.wait_for(connected.wait(), 1)
+                # Give the broker a moment to register the subscriber.
+                await asyncio.sleep(0.05)
+                backend.publish({'game_id': 1})
+                self.assertEqual(await asyncio.wait_for(listening, 1), {'game_id': 1})
+            finally:
+                listening.cancel()
+                await events.aclose()
+                backend._local.sock.close()
+                # Let the broker see both connections close before stopping it.
+                await asyncio.sleep(0.05)
+                broker.cancel()
+
+
+class GameCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = cache.GameCache()
+        self.game = Game.objects.create(state=Game.STATE_IN_PROGRESS)
+
+    def test_version_check(self):
+        """Test a cached game is used after checking its version, and reloaded once it has changed."""
+        self.cache.get(self.game.id)
+        with self.assertNumQueries(1):
+            game = self.cache.get(self.game.id)
+        self.assertEqual(game.version, 0)
+        self.game.move(PLAYER_1, 0, 0)
+        with self.assertNumQueries(2):
+            game = self.cache.get(self.game.id)
+        self.assertEqual((game.version, game.get_board()[0][0]), (1, PLAYER_1))
+
+    def test_copies(self):
+        """Test changing a game from the cache doesn't change the cached game."""
+        self.cache.get(self.game.id)
+        self.cache.get(self.game.id)._apply_move(PLAYER_1, 0, 0)
+        self.assertEqual(self.cache.get(self.game.id).legal_moves(), self.game.legal_moves())
+
+    def test_min_version(self):
+        """Test a game older than the version asked for is reloaded."""
+        self.cache.listening = True
+        self.cache.get(self.game.id)
+        Game.objects.filter(id=self.game.id).update(version=1)
+        self.assertEqual(self.cache.get(self.game.id).version, 0)
+        self.assertEqual(self.cache.get(self.game.id, min_version=1).version, 1)
+
+    def test_move_min_version(self):
+        """Test a move isn't checked against a cached game older than the version the client has seen."""
+        cache.get_cache().clear()
+        self.client.get(reverse("game:index"))
+        game = Game.objects.get(id=self.client.session['game_id'])
+        game.state = Game.STATE_IN_PROGRESS
+        game.save()
+        game.move(PLAYER_1, 0, 0)
+        cache.get_cache().remember(game)
+        # The opponent moves through another process, and this one hasn't heard yet.
+        game.move(PLAYER_2, 6, 0)
+        with mock.patch.object(cache.get_cache(), 'listening', True):
+            response = self.client.post(reverse("game:move"), {'x': 1, 'y': 0, 'version': game.version})
+        self.assertNotContains(response, "It's not your turn.")
+        self.assertEqual(Game.objects.get(id=game.id).move_count, 3)
+
+    def test_notifications(self):
+        """Test games are served without queries while listening, until a notification says they've changed."""
+        self.cache.on_connect()
+        self.cache.get(self.game.id)
+        with self.assertNumQueries(0):
+            self.cache.get(self.game.id)
+        # Our own move being announced doesn't drop it.
+        self.cache.handle_event({'game_id': self.game.id, 'version': 0})
+        with self.assertNumQueries(0):
+            self.cache.get(self.game.id)
+
+        stale_game = Game.objects.get(id=self.game.id)
+        self.game.move(PLAYER_1, 0, 0)
+        self.cache.handle_event({'game_id': self.game.id, 'version': 1})
+        # A game loaded before the notification arrived isn't cached after it.
+        self.cache.remember(stale_game)
+        self.assertEqual(self.cache.get(self.game.id).version, 1)
+
+    async def test_listen(self):
+        """Test the listener drops changed games, and everything when it reconnects."""
+        backend = notifications.InMemoryBackend()
+        self.cache.remember(Game(id=1))
+        task = asyncio.create_task(self.cache.listen(backend))
+        try:
+            await asyncio.sleep(0)
+            self.assertTrue(self.cache.listening)
+            self.assertNotIn(1, self.cache._games)
+            self.cache.remember(Game(id=1))
+            backend.publish({'game_id': 1, 'version': 1})
+            await asyncio.sleep(0.01)
+            self.assertNotIn(1, self.cache._games)
+        finally:
+            task.cancel()
+
+
+class BoardFragmentTestCase(TestCase):
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.game = Game.objects.create(state=Game.STATE_IN_PROGRESS)
+
+    def render(self):
+        request = RequestFactory().get("/board/")
+        return request, fragments.render_board(request, self.game, PLAYER_1)
+
+    def test_render_once_per_position(self):
+        """Test a board is rendered once per position, and again after a move."""
+        with mock.patch("game.fragments.get_template", wraps=fragments.get_template) as get_template:
+            self.render()
+            self.render()
+            self.assertEqual(get_template.call_count, 1)
+            self.game.move(PLAYER_1, 0, 0)
+            self.render()
+            self.assertEqual(get_template.call_count, 2)
+
+    def test_csrf_token_per_request(self):
+        """Test each request gets its own CSRF token in a cached board."""
+        request, board = self.render()
+        other_request, other_board = self.render()
+        self.assertNotEqual(board, other_board)
+        self.assertNotIn(fragments.CSRF_PLACEHOLDER, board)
+        self.assertTrue(request.META['CSRF_COOKIE_NEEDS_UPDATE'])
+
+    def test_memcached_keys(self):
+        """Test the shared cache's keys are valid for memcached, even for big boards."""
+        game = Game.objects.create(state=Game.STATE_IN_PROGRESS, width=15, height=15, win_length=5)
+        key = fragments.BoardFragmentCache._cache_key(fragments.board_key(game, PLAYER_1))
+        self.assertEqual(list(memcache_key_warnings(key)), [])
+
+    def test_reused_id(self):
+        """Test a game with another's ID, version and move count doesn't get its board."""
+        other = Game(id=self.game.id, state=Game.STATE_IN_PROGRESS)
+        other._apply_move(PLAYER_1, 0, 0)
+        self.game._apply_move(PLAYER_1, 6, 0)
+        self.assertNotEqual(fragments.board_key(other, PLAYER_1), fragments.board_key(self.game, PLAYER_1))
+        bigger = Game.objects.create(state=Game.STATE_IN_PROGRESS, width=9, height=9, win_length=5)
+        bigger.id = self.game.id
+        smaller = Game(id=self.game.id, state=Game.STATE_IN_PROGRESS)
+        self.assertNotEqual(fragments.board_key(bigger, PLAYER_1), fragments.board_key(smaller, PLAYER_1))
+
+    def test_lru_eviction(self):
+        cache = fragments.BoardFragmentCache(max_size=2)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.get(1)
+        cache.set(3, "three")
+        self.assertEqual((cache.get(1), cache.get(2), cache.get(3)), ("one", None, "three"))
+
+    def test_shared_cache(self):
+        """Test boards are shared through Django's cache when configured."""
+        fragments.BoardFragmentCache(cache_alias='default').set(("key",), "board")
+        self.assertEqual(fragments.BoardFragmentCache(cache_alias='default').get(("key",)), "board")
+
+
+class ExportImportTestCase(TestCase):
+    def test_round_trip(self):
+        """Test games exported to a packed file are imported with the same moves and state."""
+        games = [Game.objects.create(state=Game.STATE_MATCH_MAKING)]
+        for seed in range(3):
+            game = Game.objects.create(state=Game.STATE_IN_PROGRESS, computer_player=PLAYER_2 if seed else None)
+            rng = random.Random(seed)
+            while not game.is_complete() and game.move_count < 10 * seed + 5:
+                game.move(game.next_player, *rng.choice(game.legal_moves()))
+            games.append(game)
+        expected_moves = list(GameMove.objects.order_by('id').values_list('game_id', 'player', 'x_coord', 'y_coord'))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/games.bin"
+            call_command('export_games', path, chunk_size=2, stderr=mock.Mock())
+            self.assertEqual(os.path.getsize(path), packing.HEADER.size + len(games) * packing.RECORD.size)
+            Game.objects.all().delete()
+            call_command('import_games', path, batch_size=3, stderr=mock.Mock())
+
+        for game in games:
+            imported = Game.objects.get(id=game.id)
+            fields = ('state', 'winner', 'computer_player', 'board_snapshot', 'move_count', 'next_player')
+            self.assertEqual([getattr(imported, f) for f in fields], [getattr(game, f) for f in fields])
+        self.assertEqual(
+            list(GameMove.objects.order_by('id').values_list('game_id', 'player', 'x_coord', 'y_coord')),
+            expected_moves,
+        )
+        # New games don't collide with the imported IDs.
+        self.assertGreater(Game.objects.create().id, games[-1].id)
+
+    def test_bad_records(self):
+        """Test records with too many moves, a space chosen twice, or a state the moves don't lead to are rejected."""
+        def record(cells, move_count=None, state=1, winner=0):
+            if move_count is None:
+                move_count = len(cells)
+            return (1, state, winner, 0, move_count, bytes(cells).ljust(engine.CELLS, bytes([packing.NO_MOVE])))
+
+        with self.assertRaisesMessage(packing.PackingError, "more moves than the board has spaces"):
+            packing.unpack_game(record([0, 6], move_count=200))
+        with self.assertRaisesMessage(packing.PackingError, "invalid move"):
+            packing.unpack_game(record([0, 0]))
+
+        # Player 1 gets four down the left side.
+        won = [0, 6, 7, 13, 14, 20, 21]
+        game, moves = packing.unpack_game(record(won, state=2, winner=1))
+        self.assertEqual((game.winner, len(moves)), (PLAYER_1, 7))
+        for bad in (record(won), record(won, state=2, winner=2), record([0, 6], state=2), record([0, 6], state=0)):
+            with self.subTest(record=bad), self.assertRaisesMessage(packing.PackingError, "doesn't match its moves"):
+                packing.unpack_game(bad)
+        with self.assertRaisesMessage(packing.PackingError, "moves after it was won"):
+            packing.unpack_game(record(won + [27], state=2, winner=1))
+
+    def test_sequences_reset_after_failure(self):
+        """Test IDs are moved past imported games even when a later batch fails."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "games.bin")
+            with open(path, "wb") as f:
+                packing.write_header(f)
+                f.write(packing.RECORD.pack(100, 0, 0, 0, 0, bytes([packing.NO_MOVE]) * engine.CELLS))
+                f.write(packing.RECORD.pack(101, 9, 0, 0, 0, bytes([packing.NO_MOVE]) * engine.CELLS))
+            with mock.patch.object(connection.ops, "sequence_reset_sql", return_value=[]) as sequence_reset_sql:
+                with self.assertRaisesMessage(CommandError, "1 games were imported before it"):
+                    call_command('import_games', path, batch_size=1, stderr=mock.Mock())
+            sequence_reset_sql.assert_called_once()
+        self.assertTrue(Game.objects.filter(id=100).exists())
+
+    def test_bad_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"not a packed file")
+            f.flush()
+            with self.assertRaisesMessage(CommandError, "isn't a packed games file"):
+                call_command('import_games', f.name)
+
+
+class ArchiveTestCase(TestCase):
+    def play(self, seed, moves=None):
+        game = Game.objects.create(state=Game.STATE_IN_PROGRESS)
+        rng = random.Random(seed)
+        while not game.is_complete() and (moves is None or game.move_count < moves):
+            game.move(game.next_player, *rng.choice(game.legal_moves()))
+        return game
+
+    def test_archive(self):
+        """Test completed games are archived in batches, keeping their moves, and games in progress are left alone."""
+        completed = [self.play(seed) for seed in range(3)]
+        in_progress = self.play(3, moves=5)
+        expected = {game.id: game.get_moves() for game in completed}
+
+        self.assertEqual(list(archive.archive_games(batch_size=2)), [2, 1])
+        self.assertEqual(GameArchive.objects.count(), 3)
+        self.assertEqual(GameMove.objects.exclude(game=in_progress).count(), 0)
+        self.assertEqual(GameMove.objects.filter(game=in_progress).count(), 5)
+        for game in completed:
+            self.assertEqual(Game.objects.get(id=game.id).get_moves(), expected[game.id])
+        # Already archived games are skipped.
+        self.assertEqual(list(archive.archive_games()), [])
+
+    def test_archive_other_sizes(self):
+        """Test moves on boards of other sizes are archived by their own cell indexes."""
+        game = Game.objects.create(state=Game.STATE_IN_PROGRESS, width=15, height=9, win_length=5)
+        for x, y in ((14, 8), (0, 8), (13, 8)):
+            game.move(game.next_player, x, y)
+        game.state = Game.STATE_COMPLETED
+        game.save()
+        list(archive.archive_games())
+        self.assertEqual(bytes(game.archive.moves), bytes([134, 120, 133]))
+        moves = [(PLAYER_1, 14, 8), (PLAYER_2, 0, 8), (PLAYER_1, 13, 8)]
+        self.assertEqual(Game.objects.get(id=game.id).get_moves(), moves)
+
+    def test_board_view(self):
+        """Test an archived game's board can still be shown."""
+        cache.get_cache().clear()
+        self.client.get(reverse("game:index"))
+        game = Game.objects.get(id=self.client.session['game_id'])
+        game.state = Game.STATE_IN_PROGRESS
+        game.save()
+        game.move(PLAYER_1, 0, 0)
+        game.state = Game.STATE_COMPLETED
+        game.save()
+        list(archive.archive_games())
+        response = self.client.get(reverse("game:board"))
+        self.assertContains(response, 'id="space-0-0"')
+        self.assertContains(response, "bi-1-circle")
+
+
+@skipUnless(numpy, "NumPy isn't installed")
+class AnalyticsTestCase(TestCase):
+    def test_analyze(self):
+        """Test the batch statistics match the ones worked out game by game."""
+        from game import analytics
+
+        rng = random.Random(0)
+        games = [Game.objects.create(state=Game.STATE_IN_PROGRESS)]  # Unfinished, so left out.
+        for _ in range(20):
+            game = Game.objects.create(state=Game.STATE_IN_PROGRESS)
+            while not game.is_complete():
+                game.move(game.next_player, *rng.choice(game.legal_moves()))
+            games.append(game)
+        completed = games[1:]
+
+        # A cell in two of a game's lines still only counts once for that game.
+        heatmap = [0] * engine.CELLS
+        for game in completed:
+            cells = set()
+            for mask in engine.WIN_MASKS:
+                line = [index for index in range(engine.CELLS) if mask >> index & 1]
+                if all(game.board_snapshot[index] == game.winner for index in line):
+                    cells.update(line)
+            for index in cells:
+                heatmap[index] += 1
+        openings = [0] * engine.CELLS
+        for game in completed:
+            move = GameMove.objects.filter(game=game).order_by('id').first()
+            openings[engine.cell_index(move.x_coord, move.y_coord)] += 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/games.bin"
+            call_command('export_games', path, stderr=mock.Mock())
+            stats = analytics.analyze(analytics.load_games(path), chunk_size=7)
+
+        self.assertEqual(stats['games'], len(games))
+        self.assertEqual(stats['completed'], len(completed))
+        wins = sum(game.winner == PLAYER_1 for game in completed)
+        self.assertAlmostEqual(stats['first_player_win_rate'], wins / len(completed))
+        draws = sum(game.winner is None for game in completed)
+        self.assertAlmostEqual(stats['draw_rate'], draws / len(completed))
+        self.assertEqual(sum(stats['winning_line_heatmap'], []), heatmap)
+        self.assertEqual(sum(stats['opening_games'], []), openings)
+        self.assertEqual(sum(stats['length_distribution'].values()), len(completed))
+
+
+@skipUnless(numpy, "NumPy isn't installed")
+class SimulateTestCase(SimpleTestCase):
+    def test_matches_rules(self):
+        """Test simulated games replay move for move under Game's rules, ending the same way."""
+        from game import simulate
+
+        winners, move_counts, moves = simulate.simulate(300, batch_size=100, processes=0, seed=3)
+        for winner, move_count, cells in zip(winners, move_counts, moves):
+            game = Game(state=Game.STATE_IN_PROGRESS)
+            for index in cells[:move_count]:
+                self.assertFalse(game.is_complete())
+                game._apply_move(game.next_player, *engine.cell_coordinates(int(index)))
+            self.assertTrue(game.is_complete())
+            self.assertEqual(game.winner, packing.PLAYERS[winner])
+        self.assertTrue((moves[numpy.arange(len(moves)), move_counts.astype(int) - 1] != 0xFF).all())
+
+    def test_seed(self):
+        """Test the same seed plays the same games, whether or not a process pool is used."""
+        from game import simulate
+
+        inline = simulate.simulate(20, batch_size=10, processes=0, seed=5)
+        pooled = simulate.simulate(20, batch_size=10, processes=1, seed=5)
+        for expected, result in zip(inline, pooled):
+            self.assertTrue((expected == result).all())
+
+
+class GameTokenResolverTestCase(SimpleTestCase):
+    def setUp(self):
+        self.resolver = GameTokenResolver(settings.SECRET_KEY)
+
+    def test_resolve(self):
+        """Test a token made by Django resolves to its game and client."""
+        token = make_game_token(3, "abc")
+        self.assertEqual(self.resolver.resolve(token), (3, "abc"))
+        # The second time comes from the cache.
+        self.assertIn(token, self.resolver._cache)
+        self.assertEqual(self.resolver.resolve(token), (3, "abc"))
+
+    def test_bad_tokens(self):
+        """Test tampered, foreign and empty tokens are rejected."""
+        token = make_game_token(3, "abc")
+        self.assertIsNone(self.resolver.resolve(token[:-1]))
+        self.assertIsNone(GameTokenResolver("another key").resolve(token))
+        self.assertIsNone(self.resolver.resolve(""))
+
+
+class MetricsTestCase(TestCase):
+    def test_render(self):
+        """Test counters and histograms are rendered as Prometheus text."""
+        counter = metrics.Counter("test_events", "Events.", labels=("kind",), register=False)
+        counter.labels("a").inc(2)
+        histogram = metrics.Histogram("test_seconds", "Durations.", buckets=(0.1, 1), register=False)
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+
+        self.assertEqual(counter.render(), '# HELP test_events Events.\n# TYPE test_events counter\n'
+                                           'test_events_total{kind="a"} 2')
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 2.65',
+            'test_seconds_count 4',
+        ])
+
+    def test_view_metrics(self):
+        """Test requests are timed and their queries counted, by view."""
+        queries = metrics.VIEW_QUERIES.labels("index")
+        count = sum(queries.counts)
+        self.client.get(reverse('game:index'))
+        self.assertEqual(sum(queries.counts), count + 1)
+        self.assertGreater(queries.sum, 0)
+
+        response = self.client.get(reverse('game:metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertContains(response, 'sidestacker_view_seconds_count{view="index"}')
+        self.assertContains(response, 'sidestacker_matchmaking_total{outcome="created"}')
+
+
+class AsyncURLConf:
+    """The URLs with ASYNC_VIEWS set."""
+    urlpatterns = [path("", include(([
+        path("move/", views.move_async, name="move"),
+        path("board/", views.board_async, name="board"),
+        *game_urls.urlpatterns,
+    ], "game")))]
+
+
+@override_settings(GAME_NOTIFICATION_BACKEND='game.notifications.InMemoryBackend', ROOT_URLCONF=AsyncURLConf)
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_move_and_board(self):
+        """Test the async views make moves and show the board like the sync ones."""
+        self.client.get(reverse('game:index'))
+        Game.objects.update(state=Game.STATE_IN_PROGRESS)
+
+        response = self.client.post(reverse('game:move'), {'x': 0, 'y': 0})
+        self.assertContains(response, "Wait for your opponent")
+        self.assertEqual(Game.objects.get().move_count, 1)
+        response = self.client.post(reverse('game:move'), {'x': 0, 'y': 0})
+        self.assertContains(response, "alert")
+
+        response = self.client.get(reverse('game:board'), {'version': 2})
+        self.assertContains(response, "Wait for your opponent")
+        self.assertEqual(self.client.post(reverse('game:board')).status_code, 405)
+
+    def test_no_game(self):
+        """Test sessions without a game get nothing."""
+        self.assertEqual(self.client.get(reverse('game:board')).status_code, 204)
+        self.assertRedirects(self.client.post(reverse('game:move'), {'x': 0, 'y': 0}), reverse('game:index'))
+
+
+class ServeChangesTestCase(SimpleTestCase):
+    def setUp(self):
+        self.listener = GameChangesListener(notifications.InMemoryBackend())
+        self.sent = asyncio.Queue()
+        self.received = asyncio.Queue()
+
+    async def send(self, text):
+        await self.sent.put(json.loads(text))
+
+    def serve(self):
+        return asyncio.create_task(changes.serve_changes(self.listener, 1, 'abc', self.send, self.received.get))
+
+    def dispatch(self, client_id, ply):
+        self.listener.dispatch({'game_id': 1, 'client_id': client_id, 'x': 0, 'y': 0, 'player': '2', 'ply': ply})
+
+    def test_outbox_coalesces(self):
+        """Test changes waiting to be sent are replaced by the latest, without its move, and own changes dropped."""
+        outbox = changes.Outbox('abc')
+        self.listener.subscribe(1, outbox)
+        self.dispatch('other', 1)
+        self.dispatch('abc', 2)
+        self.dispatch('other', 3)
+
+        async def get():
+            return await asyncio.wait_for(outbox.get(), 1)
+        received_at, message = asyncio.run(get())
+        self.assertEqual(message, {'event': 'changed'})
+        outbox.ping()
+        self.assertEqual(asyncio.run(get()), (None, {'event': 'ping'}))
+
+    async def test_disconnect(self):
+        """Test changes are sent until the client disconnects, and the connection is unsubscribed."""
+        task = self.serve()
+        await asyncio.sleep(0)
+        self.dispatch('other', 1)
+        self.assertEqual(
+            await asyncio.wait_for(self.sent.get(), 1),
+            {'event': 'changed', 'x': 0, 'y': 0, 'player': '2', 'ply': 1})
+        await self.received.put(None)
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(self.listener._subscribers, {})
+
+    async def test_since(self):
+        """Test reconnecting clients are sent the events they missed, or told to fetch the board."""
+        for version in range(1, 4):
+            self.listener.dispatch({'game_id': 1, 'client_id': 'other', 'ply': version, 'version': version})
+        task = asyncio.create_task(
+            changes.serve_changes(self.listener, 1, 'abc', self.send, self.received.get, since=1))
+        self.assertEqual([(await asyncio.wait_for(self.sent.get(), 1))['ply'] for ply in range(2)], [2, 3])
+        await self.received.put(None)
+        await task
+
+        task = asyncio.create_task(
+            changes.serve_changes(self.listener, 2, 'abc', self.send, self.received.get, since=1))
+        self.assertEqual(await asyncio.wait_for(self.sent.get(), 1), {'event': 'changed'})
+        await self.received.put(None)
+        await task
+
+    @mock.patch('game.changes.HEARTBEAT_INTERVAL', 0.01)
+    @mock.patch('game.changes.IDLE_TIMEOUT', 0.05)
+    async def test_idle_timeout(self):
+        """Test clients are pinged, and closed once they stop answering."""
+        task = self.serve()
+        self.assertEqual(await asyncio.wait_for(self.sent.get(), 1), {'event': 'ping'})
+        await self.received.put('{"event": "pong"}')
+        with self.assertLogs('game.changes', 'INFO'):
+            await asyncio.wait_for(task, 1)
+        self.assertEqual(self.listener._subscribers, {})
+
+    @mock.patch('game.changes.SEND_TIMEOUT', 0.01)
+    async def test_send_timeout(self):
+        """Test a client too slow to take a message is closed."""
+        async def slow_send(text):
+            await asyncio.sleep(1)
+        self.send = slow_send
+        task = self.serve()
+        await asyncio.sleep(0)
+        self.dispatch('other', 1)
+        with self.assertLogs('game.changes', 'INFO'):
+            await asyncio.wait_for(task, 1)
+        self.assertEqual(self.listener._subscribers, {})
+
+
+@override_settings(GAME_NOTIFICATION_BACKEND='game.notifications.InMemoryBackend')
+class WebsocketTestCase(TestCase):
+    def make_session(self):
+        game = Game.objects.create(state=Game.STATE_IN_PROGRESS)
+        session = self.client.session
+        session['game_id'] = game.id
+        session['client_id'] = 'abc'
+        session.save()
+        return game.id, session.session_key
+
+    async def connect(self, session_key, origin=None, accepted=True):
+        headers = [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()), (b'host', b'testserver')]
+        if origin:
+            headers.append((b'origin', origin.encode()))
+        communicator = ApplicationCommunicator(websocket.router(None), {
+            'type': 'websocket',
+            'scheme': 'ws',
+            'path': websocket.PATH,
+            'headers': headers,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        if not accepted:
+            self.assertEqual(await communicator.receive_output(1), {'type': 'websocket.close'})
+            return communicator
+        self.assertEqual(await communicator.receive_output(1), {'type': 'websocket.accept'})
+        self.assertEqual(await self.receive_event(communicator), {'event': 'connected'})
+        return communicator
+
+    async def receive_event(self, communicator):
+        return json.loads((await communicator.receive_output(1))['text'])
+
+    async def test_changes(self):
+        """Test changes to the session's game made by other sessions are sent on."""
+        game_id, session_key = await sync_to_async(self.make_session)()
+        communicator = await self.connect(session_key)
+        try:
+            backend = notifications.get_backend()
+            while not backend._listeners or game_id not in websocket.get_listener()._subscribers:
+                await asyncio.sleep(0.01)
+
+            backend.publish({'game_id': game_id, 'client_id': 'abc', 'ply': 1})
+            backend.publish({'game_id': game_id + 1, 'client_id': 'other', 'ply': 1})
+            backend.publish({'game_id': game_id, 'client_id': 'other', 'x': 0, 'y': 0, 'ply': 2, 'version': 2})
+            self.assertEqual(
+                await self.receive_event(communicator),
+                {'event': 'changed', 'x': 0, 'y': 0, 'ply': 2, 'version': 2})
+
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            self.assertEqual(websocket.get_listener()._subscribers, {})
+        finally:
+            websocket._listener_task.cancel()
+
+    async def test_no_game(self):
+        """Test a session without a game gets an error."""
+        with self.assertLogs('game.websocket', 'WARNING'):
+            communicator = await self.connect('nonexistent')
+            self.assertEqual(await self.receive_event(communicator), {'event': 'error'})
+        self.assertEqual(await communicator.receive_output(1), {'type': 'websocket.close'})
+
+    @override_settings(CSRF_TRUSTED_ORIGINS=['https://trusted.example', 'https://*.example.org'])
+    async def test_origin(self):
+        """Test websockets opened by other sites are refused, even with the player's session cookie."""
+        _, session_key = await sync_to_async(self.make_session)()
+        with self.assertLogs('game.websocket', 'WARNING'):
+            await self.connect(session_key, 'https://evil.example', accepted=False)
+            await self.connect(session_key, 'https://testserver', accepted=False)
+            await self.connect(session_key, 'https://example.org.evil.example', accepted=False)
+        try:
+            for origin in ('http://testserver', 'https://trusted.example', 'https://www.example.org'):
+                communicator = await self.connect(session_key, origin)
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait(1)
+        finally:
+            websocket._listener_task.cancel()
+
+
+@override_settings(GAME_NOTIFICATION_BACKEND='game.notifications.InMemoryBackend')
+class QueryCountTestCase(TestCase):
+    """
+    Pin the number of queries each view makes, since they're most of its latency. If one goes up, find out why before
+    changing the count here and the view's budget in QUERY_BUDGETS. Counts here include the savepoints tests run
+    transactions as, which budgets don't.
+    """
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_index(self):
+        with self.assertNumQueries(8):
+            self.client.get(reverse('game:index'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('game:index'))
+
+    def test_index_join(self):
+        Game.objects.create()
+        with self.assertNumQueries(8):
+            self.client.get(reverse('game:index'))
+
+    def test_move(self):
+        self.client.get(reverse('game:index'))
+        Game.objects.update(state=Game.STATE_IN_PROGRESS, version=1)
+        self.client.get(reverse('game:board'))
+        with self.assertNumQueries(6):
+            self.client.post(reverse('game:move'), {'x': 0, 'y': 0})
+
+    def test_board(self):
+        self.client.get(reverse('game:index'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('game:board'))
+
+    def test_computer(self):
+        with self.assertNumQueries(5):
+            self.client.post(reverse('game:computer'))
+
+    def test_board_changed(self):
+        self.client.get(reverse('game:index'))
+        self.client.get(reverse('game:board'))
+        Game.objects.update(state=Game.STATE_IN_PROGRESS, version=1)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('game:board'))
+
+    def test_computer_leaving_game(self):
+        # The waiting game is claimed, then deleted along with any moves and archive it might have.
+        self.client.get(reverse('game:index'))
+        with self.assertNumQueries(12):
+            self.client.post(reverse('game:computer'))
+
+    def test_computer_after_game(self):
+        self.client.get(reverse('game:index'))
+        Game.objects.update(state=Game.STATE_COMPLETED)
+        with self.assertNumQueries(9):
+            self.client.post(reverse('game:computer'))
+
+    def test_reset(self):
+        self.client.get(reverse('game:index'))
+        with self.assertNumQueries(4):
+            self.client.post(reverse('game:reset'))
+
+    def test_metrics(self):
+        with self.assertNumQueries(0):
+            self.client.get(reverse('game:metrics'))
+
+
+@modify_settings(MIDDLEWARE={'append': 'game.middleware.QueryBudgetMiddleware'})
+class QueryBudgetMiddlewareTestCase(TestCase):
+    def test_over_budget(self):
+        """Test a request over its view's budget is logged, or fails when budgets are enforced."""
+        with self.settings(QUERY_BUDGETS={'computer': 1}), self.assertLogs('game.middleware', 'WARNING') as logs:
+            self.client.post(reverse('game:computer'))
+        self.assertIn("over the computer view's budget of 1", logs.output[0])
+
+        with self.settings(QUERY_BUDGETS={'computer': 1}, QUERY_BUDGET_ENFORCE=True):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.post(reverse('game:computer'))
+
+    @override_settings(QUERY_BUDGET_ENFORCE=True)
+    def test_within_budget(self):
+        """Test the paths the UI takes are within their views' budgets."""
+        cache.get_cache().clear()
+        self.client.get(reverse('game:index'))
+        self.client.get(reverse('game:board'))
+        Game.objects.update(state=Game.STATE_IN_PROGRESS, version=1)
+        self.client.get(reverse('game:board'))
+        self.client.post(reverse('game:move'), {'x': 0, 'y': 0, 'version': 1})
+        self.client.post(reverse('game:reset'))
+        self.client.get(reverse('game:index'))
+        self.client.post(reverse('game:computer'))
+        self.client.post(reverse('game:move'), {'x': 0, 'y': 0})
+
+    def test_repeated_queries(self):
+        """Test queries repeated within a request are logged with where they came from."""
+        game = Game.objects.create()
+        session = self.client.session
+        session['game_id'] = game.id
+        session.save()
+
+        def get_game_twice(game_id, min_version=None):
+            Game.objects.get(id=game_id)
+            return Game.objects.get(id=game_id)
+
+        with mock.patch('game.views.get_game', get_game_twice), self.assertLogs('game.middleware', 'WARNING') as logs:
+            self.client.get(reverse('game:board'))
+        self.assertIn("Duplicate query made 2 times by /board/ from game/tests.py:", logs.output[0])
+
+
+class MatchMakingTestCase(TestCase):
+    def test_create_then_join(self):
+        """Test the first player creates a game and the second joins it."""
+        created, joined_count = matchmaking.CREATED.value, matchmaking.JOINED.value
+        game, player, joined = join_or_create_game()
+        self.assertEqual((player, joined), (PLAYER_1, False))
+        self.assertTrue(game.is_match_making())
+
+        joined_game, player, joined = join_or_create_game()
+        self.assertEqual((joined_game.id, player, joined), (game.id, PLAYER_2, True))
+        self.assertEqual(Game.objects.get(id=game.id).state, Game.STATE_IN_PROGRESS)
+        self.assertEqual(joined_game.version, 1)
+        self.assertEqual((matchmaking.CREATED.value, matchmaking.JOINED.value), (created + 1, joined_count + 1))
+
+    def test_join_longest_waiting(self):
+        """Test the oldest waiting game is joined first."""
+        first_game = Game.objects.create()
+        Game.objects.create()
+        game, player, joined = join_or_create_game()
+        self.assertEqual(game.id, first_game.id)
+
+    def test_dimensions(self):
+        """Test only games with the same dimensions and win length are joined, and invalid ones are refused."""
+        Game.objects.create()
+        game, player, joined = join_or_create_game(width=9, height=9, win_length=5)
+        self.assertFalse(joined)
+        self.assertEqual((game.width, game.height, game.win_length), (9, 9, 5))
+        joined_game, player, joined = join_or_create_game(width=9, height=9, win_length=5)
+        self.assertEqual((joined_game.id, joined), (game.id, True))
+        with self.assertRaises(ValidationError):
+            join_or_create_game(width=20)
+
+    def test_full_games_not_joined(self):
+        """Test a game already in progress isn't joined."""
+        Game.objects.create(state=Game.STATE_IN_PROGRESS)
+        game, player, joined = join_or_create_game()
+        self.assertFalse(joined)
+        self.assertEqual(Game.objects.count(), 2)
+
+
+class SearchTestCase(SimpleTestCase):
+    def choose_move(self, moves, player):
+        bitboard = Bitboard.from_moves(moves)
+        index = ai.choose_move(bitboard.to_snapshot(), player, 0.15, 8, 1 << 16)
+        return engine.cell_coordinates(index)
+
+    def test_takes_win(self):
+        """Test the search completes a line when it can."""
+        moves = [(PLAYER_1, 0, 0), (PLAYER_2, 0, 1), (PLAYER_1, 1, 0), (PLAYER_2, 0, 2), (PLAYER_1, 2, 0),
+                 (PLAYER_2, 0, 3)]
+        self.assertEqual(self.choose_move(moves, PLAYER_1), (3, 0))
+
+    def test_blocks_win(self):
+        """Test the search stops the opponent completing a line."""
+        moves = [(PLAYER_1, 0, 0), (PLAYER_2, 0, 1), (PLAYER_1, 1, 0), (PLAYER_2, 6, 6), (PLAYER_1, 2, 0)]
+        self.assertEqual(self.choose_move(moves, PLAYER_2), (3, 0))
+
+    def test_legal_move(self):
+        """Test the chosen move follows the side stacking rule."""
+        moves = [(PLAYER_1, 0, 3), (PLAYER_2, 6, 3)]
+        x, y = self.choose_move(moves, PLAYER_1)
+        self.assertTrue(Bitboard.from_moves(moves).is_legal(x, y))
+
+    def test_transposition_table_is_bounded(self):
+        """Test the table keeps its size however much is stored, and deeper results aren't replaced."""
+        table = ai.TranspositionTable(4)
+        table.new_search()
+        table.store(1, 5, ai.EXACT, 10, 3)
+        table.store(5, 2, ai.EXACT, 20, 4)  # Same slot, shallower.
+        self.assertEqual(table.probe(1)[3], 10)
+        self.assertIsNone(table.probe(5))
+        table.new_search()
+        table.store(5, 2, ai.EXACT, 20, 4)  # Same slot, but the old result is from the last search.
+        self.assertEqual(table.probe(5)[3], 20)
+        self.assertEqual(len(table.slots), 4)
+
+
+@override_settings(AI_PROCESSES=0, AI_TIME_BUDGET=0.05)
+@mock.patch("game.bot.close_old_connections")
+@mock.patch("game.bot.notify_game_event")
+class ComputerOpponentTestCase(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.game = Game.objects.create(state=Game.STATE_IN_PROGRESS, computer_player=PLAYER_2)
+
+    def test_play_reply(self, notify_game_event, close_old_connections):
+        """Test the computer replies to the human's move and announces it."""
+        self.game.move(PLAYER_1, 0, 0)
+        bot.play_reply(self.game.id)
+        game = Game.objects.get(id=self.game.id)
+        self.assertEqual(game.move_count, 2)
+        self.assertEqual(game.next_player, PLAYER_1)
+        notify_game_event.assert_called_once()
+
+    def test_no_reply_out_of_turn(self, notify_game_event, close_old_connections):
+        """Test the computer doesn't move when it's the human's turn."""
+        bot.play_reply(self.game.id)
+        self.assertEqual(Game.objects.get(id=self.game.id).move_count, 0)
+        notify_game_event.assert_not_called()
+
+    @mock.patch("game.views.schedule_reply")
+    def test_views(self, schedule_reply, notify_game_event, close_old_connections):
+        """Test starting a game against the computer and having it reply to a move."""
+        self.client.post(reverse("game:computer"))
+        game = Game.objects.get(id=self.client.session['game_id'])
+        self.assertTrue(game.is_against_computer())
+        self.assertEqual(self.client.session['player'], PLAYER_1)
+
+        self.client.post(reverse("game:move"), {'x': 0, 'y': 0})
+        schedule_reply.assert_called_once()
+
+
+    def test_leave_waiting_game(self, notify_game_event, close_old_connections):
+        """Test the game waiting for a match is deleted, unless an opponent got there first."""
+        self.client.get(reverse("game:index"))
+        waiting_id = self.client.session['game_id']
+        self.client.post(reverse("game:computer"))
+        self.assertFalse(Game.objects.filter(id=waiting_id).exists())
+
+        self.client.post(reverse("game:reset"))
+        self.client.get(reverse("game:index"))
+        joined, player, _ = join_or_create_game()
+        count = Game.objects.count()
+        self.client.post(reverse("game:computer"))
+        self.assertEqual(self.client.session['game_id'], joined.id)
+        self.assertEqual(Game.objects.get(id=joined.id).state, Game.STATE_IN_PROGRESS)
+        self.assertEqual(Game.objects.count(), count)
+
+
+class BenchmarkTestCase(SimpleTestCase):
+    def test_random_playout(self):
+        """Test a random playout ends in a complete game without touching the database."""
+        game, timings = benchmarks.random_playout(random.Random(1))
+        self.assertTrue(game.is_complete())
+        self.assertEqual(len(timings), game.move_count)
+
+    def test_compare(self):
+        """Test slower medians and extra queries are reported as regressions."""
+        baseline = {'views': {'board': {'median_us': 100, 'queries_max': 2}, 'move': {'median_us': 100}}}
+        results = {'views': {'board': {'median_us': 100, 'queries_max': 3}, 'move': {'median_us': 115}}}
+        self.assertEqual([name for name, old, new in benchmarks.compare(results, baseline, 1.2)], ['views.board'])
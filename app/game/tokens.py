@@ -0,0 +1,71 @@
+"""
+Signed tokens telling the websocket server which game a client is playing.
+
+views.index issues a token with the page, and the client passes it when opening its websocket. The websocket server
+checks the signature with the shared SECRET_KEY instead of asking Django to look up the session.
+
+Tokens are signed, not encrypted, and end up in page HTML and websocket URLs, so they carry the session's client ID
+rather than its session key, which would let anyone who saw one use the session.
+"""
+import secrets
+import time
+
+from django.core import signing
+
+SALT = "game.tokens"
+MAX_AGE = 60 * 60 * 24  # Seconds. Clients get a new token whenever they load the page.
+
+
+def get_client_id(session):
+    """
+    Return the session's client ID, making one the first time. It's a random value, not a secret, which identifies the
+    session to game events and websockets.
+    """
+    client_id = session.get('client_id')
+    if client_id is None:
+        client_id = session['client_id'] = secrets.token_urlsafe(16)
+    return client_id
+
+
+def make_game_token(game_id, client_id):
+    """Return a token for the client playing the game."""
+    return signing.dumps({'game_id': game_id, 'client_id': client_id}, salt=SALT)
+
+
+class GameTokenResolver:
+    """
+    Verify game tokens without Django settings, remembering recent results for a short time.
+
+    Clients reconnecting after a deploy or a network blip present the same token again, so the cache spares the
+    signature check during reconnect storms.
+    """
+
+    def __init__(self, secret_key, ttl=60, max_size=10000):
+        self.secret_key = secret_key
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = {}  # Token to (expiry time, (game ID, client ID)).
+
+    def resolve(self, token):
+        """Return (game ID, client ID) for a valid token, or None."""
+        now = time.monotonic()
+        cached = self._cache.get(token)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        try:
+            data = signing.loads(token, key=self.secret_key, salt=SALT, max_age=MAX_AGE, fallback_keys=())
+            result = (int(data['game_id']), data['client_id'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            return None
+
+        if len(self._cache) >= self.max_size:
+            self._prune(now)
+        self._cache[token] = (now + self.ttl, result)
+        return result
+
+    def _prune(self, now):
+        """Drop expired entries, or everything if they're all still fresh."""
+        self._cache = {token: entry for token, entry in self._cache.items() if entry[0] > now}
+        if len(self._cache) >= self.max_size:
+            self._cache = {}
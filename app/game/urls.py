@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -5,8 +6,9 @@ from . import views
 app_name = "game"
 urlpatterns = [
     path("", views.index, name="index"),
-    path("move/", views.move, name="move"),
-    path("board/", views.board, name="board"),
+    path("move/", views.move_async if settings.ASYNC_VIEWS else views.move, name="move"),
+    path("board/", views.board_async if settings.ASYNC_VIEWS else views.board, name="board"),
     path("reset/", views.reset, name="reset"),
-    path("_game/", views.game, name="game"),  # _ in name indicates private usage- for Sanic only.
+    path("computer/", views.computer, name="computer"),
+    path("metrics/", views.metrics_view, name="metrics"),
 ]
@@ -1,18 +1,21 @@
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import connection
-from django.http import JsonResponse, HttpResponse
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotAllowed
 from django.shortcuts import render, redirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.http import require_POST, require_GET
 
+from . import metrics
+from .bot import schedule_reply
+from .cache import aget_game, get_game, remember_game
 from .forms import MoveForm
+from .matchmaking import join_or_create_game
 from .models import Game, PLAYER_1, PLAYER_2
-
-
-def notify_game_event(game_id, session_key):
-    """Send a notification via PostgreSQL."""
-    cursor = connection.cursor()
-    cursor.execute(f"NOTIFY game_changes, '{game_id}:{session_key}'")
+from .notifications import notify_game_event
+from .tokens import get_client_id, make_game_token
 
 
 @require_GET
@@ -29,31 +32,17 @@ def index(request):
     game_id = request.session.get('game_id')
     if game_id:
         try:
-            game = Game.objects.get(id=game_id)
+            game = get_game(game_id)
             player = request.session.get('player')
         except Game.DoesNotExist:
             # This "should" never happen.
             game = None
 
     if not game:
-        # Session didn't already have a game, so find a game waiting for a match, or create a new one.
-        match_making_game = Game.objects.filter(state=Game.STATE_MATCH_MAKING).first()
-        if match_making_game:
-            # Update the game with update() to handle the race condition of 2 clients finding the same
-            # matchmaking game at the same time. Only 1 will be able to update it.
-            games_updated = Game.objects.filter(id=match_making_game.id).update(state=Game.STATE_IN_PROGRESS)
-            if games_updated > 0:
-                # We successfully joined the game and updated the status.
-                match_making_game.refresh_from_db()
-                game = match_making_game
-                player = PLAYER_2  # We joined the game so we're player 2.
-                notify_game_event(game.id, request.session.session_key)
-
-        if not game:
-            # No game was waiting for a match, or we failed to change a game to in progress,
-            # so create a new game.
-            game = Game.objects.create()
-            player = PLAYER_1  # We created the game so we're player 1.
+        # Session didn't already have a game, so join a game waiting for a match, or create a new one.
+        game, player, joined = join_or_create_game()
+        if joined:
+            notify_game_event(game, get_client_id(request.session))
 
         request.session['game_id'] = game.id  # Serialize the ID, not the game itself.
         request.session['player'] = player
@@ -62,31 +51,64 @@ def index(request):
         'game': game,
         'player': player,
         'websocket_url': settings.WEBSOCKET_URL,
+        'websocket_token': make_game_token(game.id, get_client_id(request.session)),
         'board_url': reverse('game:board'),
+        'board_etag': board_etag(game, player),
     }
     return render(request, "game/index.html", context)
 
 
 @require_POST
 def move(request):
-    """Perform the move."""
+    """
+    Perform the move.
+
+    Like board requests, moves carry the latest version of the game the client has been told about. A cached game
+    older than that would reject the move as out of turn.
+    """
     try:
-        game = Game.objects.get(id=request.session.get('game_id'))
+        game = get_game(request.session.get('game_id'), _get_min_version(request.POST))
         player = request.session.get('player')
     except Game.DoesNotExist:
         # This is unrecoverable.
         return redirect('game:index')
 
+    error_message = _make_move(request, game, player)
+    return _render_move(request, game, player, error_message)
+
+
+async def move_async(request):
+    """The move view for ASGI deployments, see ASYNC_VIEWS."""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    game_id, player = await _get_session_game(request)
+    try:
+        game = await aget_game(game_id, _get_min_version(request.POST))
+    except Game.DoesNotExist:
+        return redirect('game:index')
+
+    # Moves are saved in a transaction, which the async ORM can't do.
+    error_message = await sync_to_async(_make_move)(request, game, player)
+    return _render_move(request, game, player, error_message)
+
+
+def _make_move(request, game, player):
+    """Make the move posted, and return the error message if it isn't valid."""
     form = MoveForm(game, player, request.POST)
-    error_message = None
-    if form.is_valid():
-        # It would be more elegant to handle this with signals, but since we need to include the session ID it must
-        # be done here.
-        notify_game_event(game.id, request.session.session_key)
-    else:
+    if not form.is_valid():
         # Django supports multiple error messages but in our case there will only ever be one.
-        error_message = form.non_field_errors()[0]
+        return form.non_field_errors()[0]
+
+    remember_game(game)
+    # It would be more elegant to handle this with signals, but since we need to include the client ID it must be
+    # done here.
+    notify_game_event(game, get_client_id(request.session), player, form.cleaned_data['x'], form.cleaned_data['y'])
+    if game.is_against_computer() and not game.is_complete():
+        schedule_reply(game)
+    return None
+
 
+def _render_move(request, game, player, error_message):
     context = {
         'game': game,
         'player': player,
@@ -98,20 +120,96 @@ def move(request):
 
 @require_GET
 def board(request):
-    """Return just the board content."""
+    """
+    Return just the board content.
+
+    Clients pass the latest version of the game they've been told about, so they never get an older board. The game
+    comes from the cache, checked with a single column lookup, so a client whose copy is current gets 304 Not Modified
+    without the board being rendered.
+    """
     try:
-        game = Game.objects.get(id=request.session.get('game_id'))
+        game = get_game(request.session.get('game_id'), _get_min_version(request.GET))
         player = request.session.get('player')
     except Game.DoesNotExist:
         # This is unrecoverable.
         return HttpResponse(status=204)
+    return _render_board(request, game, player)
+
+
+async def board_async(request):
+    """The board view for ASGI deployments, see ASYNC_VIEWS."""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    game_id, player = await _get_session_game(request)
+    try:
+        game = await aget_game(game_id, _get_min_version(request.GET))
+    except Game.DoesNotExist:
+        return HttpResponse(status=204)
+    return _render_board(request, game, player)
+
+
+def _get_min_version(params):
+    try:
+        return int(params['version'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _render_board(request, game, player):
+    """Render the board, or return 304 Not Modified if the client's copy matches."""
+    etag = board_etag(game, player)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        context = {
+            'game': game,
+            'player': player,
+        }
+        template = 'game/complete.html' if game.is_complete() else 'game/in_progress.html'
+        response = render(request, template, context)
+    response.headers['ETag'] = etag
+    # Browsers must check their copy with us every time, and shared caches mustn't keep it.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def board_etag(game, player):
+    """Return a strong ETag for the game's board as the player sees it."""
+    return f'"{game.id}-{game.move_count}-{game.state.replace(" ", "_")}-{player}"'
+
+
+@sync_to_async
+def _get_session_game(request):
+    """Return the session's (game ID, player). Sessions have no async API in this version of Django."""
+    return request.session.get('game_id'), request.session.get('player')
+
+
+@require_POST
+def computer(request):
+    """
+    Start a new game against the computer, leaving any game waiting for a match.
+
+    The waiting game is claimed before it's deleted, so an opponent joining it at the same moment either loses the race
+    or wins it, and then the game goes on against them instead.
+    """
+    game_id = request.session.get('game_id')
+    if game_id:
+        with transaction.atomic():
+            # Nobody else can join a game that's been given up on, see join_or_create_game().
+            left = Game.objects.filter(id=game_id, state=Game.STATE_MATCH_MAKING).update(
+                state=Game.STATE_COMPLETED,
+                version=F('version') + 1,
+            )
+            if left:
+                Game.objects.filter(id=game_id).delete()
+        if not left and Game.objects.filter(id=game_id, state=Game.STATE_IN_PROGRESS).exists():
+            return redirect('game:index')
+
+    # The human goes first.
+    game = Game.objects.create(state=Game.STATE_IN_PROGRESS, computer_player=PLAYER_2)
+    request.session['game_id'] = game.id
+    request.session['player'] = PLAYER_1
+    return redirect('game:index')
 
-    context = {
-        'game': game,
-        'player': player,
-    }
-    template = 'game/complete.html' if game.is_complete() else 'game/in_progress.html'
-    return render(request, template, context)
 
 @require_POST
 def reset(request):
@@ -122,8 +220,6 @@ def reset(request):
 
 
 @require_GET
-def game(request):
-    """Return the game ID associated with the session, if any."""
-    return JsonResponse({
-        "id": request.session.get('game_id'),
-    })
+def metrics_view(request):
+    """Return this process's metrics for Prometheus to scrape."""
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
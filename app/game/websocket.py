@@ -0,0 +1,147 @@
+"""
+The changes websocket, served from Django's ASGI application (see sidestacker/asgi.py) instead of the Sanic server.
+
+It speaks the same protocol as blueprint.changes (see changes.py), or sends an "error" event if there's no game. Here
+the game comes straight from the Django session, so the token clients pass isn't needed. Since browsers send cookies
+with websockets opened by any site, connections from other origins are refused, as CsrfViewMiddleware would. Each worker
+has one GameChangesListener, on its event loop.
+"""
+import asyncio
+import json
+import logging
+from importlib import import_module
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import parse_cookie
+from django.http.request import split_domain_port, validate_host
+from django.utils.http import is_same_domain
+
+from . import metrics
+from .changes import parse_since, serve_changes
+from .listener import GameChangesListener
+from .notifications import get_backend
+
+logger = logging.getLogger(__name__)
+
+PATH = "/changes/"
+
+_listener = None
+_listener_task = None
+
+
+def get_listener():
+    """Return the worker's game changes listener, starting it on the running event loop if need be."""
+    global _listener, _listener_task
+    loop = asyncio.get_running_loop()
+    if _listener is None or _listener_task.get_loop() is not loop:
+        _listener = GameChangesListener(get_backend())
+        _listener_task = loop.create_task(_listener.run(), name="game_changes_listener")
+    return _listener
+
+
+def get_session(scope):
+    """Return the session for the connection's session cookie, as SessionMiddleware would. It's loaded lazily."""
+    cookies = {}
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            cookies.update(parse_cookie(value.decode('latin1')))
+    engine = import_module(settings.SESSION_ENGINE)
+    return engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+
+
+def origin_allowed(scope):
+    """
+    Return whether the connection comes from this site, or one in CSRF_TRUSTED_ORIGINS. Connections without an Origin
+    header don't come from a browser, so they're allowed.
+    """
+    headers = dict(scope.get('headers', ()))
+    if b'origin' not in headers:
+        return True
+    origin = headers[b'origin'].decode('latin1')
+    if origin in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    parsed = urlsplit(origin)
+    for trusted in map(urlsplit, settings.CSRF_TRUSTED_ORIGINS):
+        if trusted.netloc.startswith('*') and trusted.scheme == parsed.scheme and is_same_domain(
+                parsed.netloc, trusted.netloc[1:]):
+            return True
+
+    # The same checks as HttpRequest.get_host().
+    host = headers.get(b'host', b'').decode('latin1')
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    scheme = 'https' if scope.get('scheme') == 'wss' else 'http'
+    return origin == f'{scheme}://{host}' and validate_host(split_domain_port(host)[0], allowed_hosts)
+
+
+def router(http_application):
+    """Return an ASGI application serving the changes websocket, and everything else with http_application."""
+
+    async def application(scope, receive, send):
+        if scope['type'] != 'websocket':
+            await http_application(scope, receive, send)
+        elif scope['path'] == PATH:
+            await changes(scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close'})
+
+    return application
+
+
+async def changes(scope, receive, send):
+    """
+    When a notification about game updates is received, emit an event on the websocket.
+    """
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    if not origin_allowed(scope):
+        logger.warning("Rejected websocket from another origin")
+        await send({'type': 'websocket.close'})
+        return
+    await send({'type': 'websocket.accept'})
+    metrics.WEBSOCKETS_OPEN.inc()
+    try:
+        await _send_changes(scope, receive, send)
+    finally:
+        metrics.WEBSOCKETS_OPEN.dec()
+
+
+async def _send_changes(scope, receive, send):
+    await _send_event(send, {'event': 'connected'})
+
+    # Sessions have no async API in this version of Django.
+    session = get_session(scope)
+    game_id, client_id = await sync_to_async(_get_session_game)(session)
+    if game_id is None:
+        logger.warning("Rejected websocket without a game in its session")
+        await _send_event(send, {'event': 'error'})
+        await send({'type': 'websocket.close'})
+        return
+
+    disconnected = False
+
+    async def send_text(text):
+        await send({'type': 'websocket.send', 'text': text})
+
+    async def receive_message():
+        nonlocal disconnected
+        message = await receive()
+        disconnected = message['type'] == 'websocket.disconnect'
+        return None if disconnected else message
+
+    since = parse_since(parse_qs(scope.get('query_string', b'').decode('latin1')).get('since', [None])[0])
+    await serve_changes(get_listener(), game_id, client_id, send_text, receive_message, since)
+    if not disconnected:
+        await send({'type': 'websocket.close'})
+
+
+def _get_session_game(session):
+    return session.get('game_id'), session.get('client_id')
+
+
+async def _send_event(send, event):
+    await send({'type': 'websocket.send', 'text': json.dumps(event)})
@@ -0,0 +1,214 @@
+"""
+Load test: simulate many players joining and playing full games against a running Side-Stacker.
+
+Each simulated player loads the index page to be matched up, keeps a websocket open to the Sanic server, refreshes
+the board whenever it's told the game changed, and makes a random legal move when it's their turn. Latencies and
+errors are collected per endpoint and reported as percentiles.
+
+Run Django (runserver or an ASGI server) and Sanic as usual, then:
+
+    python loadtest.py --clients 1000 --http-url http://127.0.0.1:8000/ --ws-url ws://127.0.0.1:8001/
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import time
+from collections import defaultdict
+
+import aiohttp
+
+TOKEN_RE = re.compile(r'changes/\?token=([^"&]+)')
+GAME_ID_RE = re.compile(r'<!-- Game id (\d+)-->')
+PLY_RE = re.compile(r'data-ply="(\d+)"')
+MOVE_RE = re.compile(r'name="x" type="hidden" value="(\d+)">\s*<input name="y" type="hidden" value="(\d+)"')
+YOUR_TURN = "Make your move."
+GAME_OVER = ('won.', 'lost.', "It's a draw!")
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # Name to seconds.
+        self.errors = defaultdict(int)
+        self.requests = defaultdict(int)
+        self.games_completed = 0
+        self.move_sent_at = {}  # (game ID, ply) to when the move making that ply was sent.
+
+    def record(self, name, seconds):
+        self.latencies[name].append(seconds)
+
+    def report(self):
+        """Return the percentiles and error rates as a dict."""
+        report = {'games_completed': self.games_completed, 'latency_ms': {}, 'errors': {}}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            report['latency_ms'][name] = {
+                'count': len(latencies),
+                'p50': statistics.median(latencies) * 1000,
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+                'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+                'max': latencies[-1] * 1000,
+            }
+        for name, requests in sorted(self.requests.items()):
+            report['errors'][name] = {
+                'count': self.errors[name],
+                'rate': self.errors[name] / requests if requests else 0,
+            }
+        return report
+
+
+class SimulatedPlayer:
+    def __init__(self, args, stats, rng):
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.changed = asyncio.Event()
+        self.game_id = None
+        self.ply = 0
+
+    async def request(self, session, name, method, path, **kwargs):
+        """Make a request, recording its latency or error. Return the body, or None on error."""
+        self.stats.requests[name] += 1
+        start = time.perf_counter()
+        try:
+            async with session.request(method, self.args.http_url + path, **kwargs) as response:
+                body = await response.text()
+                if response.status >= 400:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.stats.errors[name] += 1
+            return None
+        self.stats.record(name, time.perf_counter() - start)
+        return body
+
+    async def play(self):
+        jar = aiohttp.CookieJar(unsafe=True)  # Cookies for IP address hosts like 127.0.0.1 too.
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        self.stats.requests['player'] += 1
+        async with aiohttp.ClientSession(cookie_jar=jar, timeout=timeout) as session:
+            joined_at = time.perf_counter()
+            page = await self.request(session, 'index', 'GET', '')
+            if page is None:
+                return
+            self.game_id = int(GAME_ID_RE.search(page).group(1))
+            token = TOKEN_RE.search(page).group(1)
+            waiting = 'Wait for your opponent to join' in page
+
+            self.stats.requests['websocket'] += 1
+            try:
+                ws = await session.ws_connect(f"{self.args.ws_url}changes/?token={token}")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.stats.errors['websocket'] += 1
+                return
+            listener = asyncio.create_task(self.listen(ws))
+            try:
+                if waiting:
+                    await self.wait_for_change()
+                self.stats.record('matchmaking_wait', time.perf_counter() - joined_at)
+                await self.play_game(session)
+            finally:
+                listener.cancel()
+                await ws.close()
+
+    async def listen(self, ws):
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            event = json.loads(message.data)
+            if event.get('event') == 'ping':
+                await ws.send_json({'event': 'pong'})
+                continue
+            if event.get('event') != 'changed':
+                continue
+            sent_at = self.stats.move_sent_at.pop((self.game_id, event.get('ply')), None)
+            if sent_at is not None:
+                self.stats.record('move_to_notification', time.perf_counter() - sent_at)
+            self.changed.set()
+
+    async def wait_for_change(self):
+        """Wait for the websocket to say the game changed, or poll the board if it takes too long."""
+        self.stats.requests['notification'] += 1
+        try:
+            await asyncio.wait_for(self.changed.wait(), self.args.poll_interval)
+        except asyncio.TimeoutError:
+            self.stats.errors['notification'] += 1
+        self.changed.clear()
+
+    async def play_game(self, session):
+        self.stats.requests['game'] += 1
+        deadline = time.perf_counter() + self.args.game_timeout
+        board = await self.request(session, 'board', 'GET', 'board/')
+        while board is not None:
+            if time.perf_counter() > deadline:
+                # Probably the opponent gave up after errors of their own.
+                self.stats.errors['game'] += 1
+                return
+            if any(text in board for text in GAME_OVER):
+                self.stats.games_completed += 1
+                return
+            self.ply = int(PLY_RE.search(board).group(1))
+            if YOUR_TURN in board:
+                await asyncio.sleep(self.rng.uniform(0, self.args.think_time))
+                x, y = self.rng.choice(MOVE_RE.findall(board))
+                self.stats.move_sent_at[(self.game_id, self.ply + 1)] = time.perf_counter()
+                board = await self.request(session, 'move', 'POST', 'move/', data={'x': x, 'y': y}, headers={
+                    'X-CSRFToken': self.csrf_token(session),
+                })
+                continue
+            await self.wait_for_change()
+            board = await self.request(session, 'board', 'GET', 'board/')
+
+    def csrf_token(self, session):
+        cookie = session.cookie_jar.filter_cookies(self.args.http_url).get('csrftoken')
+        return cookie.value if cookie else ''
+
+
+async def run(args):
+    stats = Stats()
+    rng = random.Random(args.seed)
+    players = []
+    for _ in range(args.clients):
+        players.append(asyncio.create_task(SimulatedPlayer(args, stats, random.Random(rng.random())).play()))
+        await asyncio.sleep(1 / args.spawn_rate)
+    for result in await asyncio.gather(*players, return_exceptions=True):
+        if isinstance(result, Exception):
+            # Most likely a page that didn't look as expected.
+            stats.errors['player'] += 1
+            print(f"Player failed: {result!r}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=100, help="Simulated players, two per game.")
+    parser.add_argument('--spawn-rate', type=float, default=50, help="Players started per second.")
+    parser.add_argument('--http-url', default='http://127.0.0.1:8000/')
+    parser.add_argument('--ws-url', default='ws://127.0.0.1:8001/')
+    parser.add_argument('--think-time', type=float, default=0.5, help="Most seconds to wait before moving.")
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help="Seconds to wait for a notification before fetching the board anyway.")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds before a request counts as failed.")
+    parser.add_argument('--game-timeout', type=float, default=600, help="Seconds before a game counts as failed.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="File to write the report to as JSON.")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    report = asyncio.run(run(args)).report()
+    report['seconds'] = time.perf_counter() - started
+
+    for name, latency in report['latency_ms'].items():
+        print(f"{name:22} n={latency['count']:<7} p50={latency['p50']:8.1f}ms p95={latency['p95']:8.1f}ms "
+              f"p99={latency['p99']:8.1f}ms max={latency['max']:8.1f}ms")
+    for name, errors in report['errors'].items():
+        print(f"{name:22} errors={errors['count']:<7} rate={errors['rate']:.2%}")
+    print(f"{report['games_completed']} games completed in {report['seconds']:.1f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
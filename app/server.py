@@ -6,7 +6,10 @@ from game.blueprint import game_blueprint
 app = Sanic("SideStacker")
 env = environ.Env()
 
-app.config.HTTP_URL = env.str('HTTP_URL', 'http://127.0.0.1:8000/')  # Where Sanic should connect to the HTTP server.
+app.config.SECRET_KEY = env.str('SECRET_KEY')  # Must match Django's, to verify game tokens.
 app.config.DATABASE_URL = env.str('DATABASE_URL')
+# Must match Django's GAME_NOTIFICATION_BACKEND and GAME_NOTIFICATION_SOCKET.
+app.config.NOTIFICATION_BACKEND = env.str('GAME_NOTIFICATION_BACKEND', 'game.notifications.PostgresBackend')
+app.config.NOTIFICATION_SOCKET = env.str('GAME_NOTIFICATION_SOCKET', '/tmp/sidestacker-notifications.sock')
 
 app.blueprint(game_blueprint)
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sidestacker.settings')
+# Each worker runs an event loop, so use the async versions of the busiest views.
+os.environ.setdefault('ASYNC_VIEWS', 'true')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Also serve the changes websocket, so no separate websocket server is needed. Imported once Django is set up.
+from game.websocket import router  # noqa: E402
+
+application = router(django_application)
@@ -27,8 +27,45 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = env('SECRET_KEY')
 DEBUG = env('DEBUG')
 
-WEBSOCKET_URL = env.str('WEBSOCKET_URL', 'ws://127.0.0.1:8001/')  # Where clients should connect to Sanic.
-
+# Where clients should connect to Sanic, or to this server if it's running as ASGI, which also serves the websocket.
+WEBSOCKET_URL = env.str('WEBSOCKET_URL', 'ws://127.0.0.1:8001/')
+# Use the async versions of the board and move views. On by default under ASGI, see asgi.py.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', False)
+
+# How game changes get to the websocket server, see game.notifications. The socket is for UnixSocketBackend, and the
+# websocket server reads both from the same environment variables.
+GAME_NOTIFICATION_BACKEND = env.str('GAME_NOTIFICATION_BACKEND', 'game.notifications.PostgresBackend')
+GAME_NOTIFICATION_SOCKET = env.str('GAME_NOTIFICATION_SOCKET', '/tmp/sidestacker-notifications.sock')
+
+# Rendered boards are cached per process, up to BOARD_CACHE_SIZE of them, and in the Django cache named by
+# BOARD_CACHE_ALIAS if set so that processes can share them.
+BOARD_CACHE_SIZE = env.int('BOARD_CACHE_SIZE', 1024)
+BOARD_CACHE_ALIAS = env.str('BOARD_CACHE_ALIAS', '')
+
+# Games are cached per process, up to GAME_CACHE_SIZE of them. Cached games are checked against the database's version
+# before use, unless GAME_CACHE_LISTEN is set, when each process listens for game change notifications instead.
+GAME_CACHE_SIZE = env.int('GAME_CACHE_SIZE', 1024)
+GAME_CACHE_LISTEN = env.bool('GAME_CACHE_LISTEN', False)
+
+# Computer opponent. Replies get AI_TIME_BUDGET seconds of search, up to AI_MAX_DEPTH moves ahead. Searches run on a
+# pool of AI_PROCESSES processes (0 to search in the replying thread), fed by AI_THREADS threads per web process.
+AI_TIME_BUDGET = env.float('AI_TIME_BUDGET', 0.15)
+AI_MAX_DEPTH = env.int('AI_MAX_DEPTH', 8)
+AI_PROCESSES = env.int('AI_PROCESSES', 2)
+AI_THREADS = env.int('AI_THREADS', 4)
+AI_TRANSPOSITION_TABLE_SIZE = env.int('AI_TRANSPOSITION_TABLE_SIZE', 1 << 18)  # Entries, per search process.
+
+# Queries each view may make, checked in development by game.middleware.QueryBudgetMiddleware. Requests over budget are
+# logged, or fail if QUERY_BUDGET_ENFORCE is set.
+QUERY_BUDGETS = {
+    'index': 4,
+    'move': 5,
+    'board': 3,
+    'computer': 8,
+    'reset': 2,
+    'metrics': 0,
+}
+QUERY_BUDGET_ENFORCE = env.bool('QUERY_BUDGET_ENFORCE', False)
 ALLOWED_HOSTS = []
 
 
@@ -45,6 +82,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'game.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +91,9 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+if DEBUG:
+    # Outside the session middleware, so its queries count too.
+    MIDDLEWARE.insert(1, 'game.middleware.QueryBudgetMiddleware')
 
 ROOT_URLCONF = 'sidestacker.urls'
 
@@ -80,6 +121,8 @@ WSGI_APPLICATION = 'sidestacker.wsgi.application'
 DATABASES = {
     'default': env.db(),
 }
+# The same database as a URL, for listening to PostgresBackend notifications with aiopg.
+DATABASE_URL = env.str('DATABASE_URL')
 
 
 # Password validation